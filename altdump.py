@@ -1,9 +1,12 @@
 #!/usr/bin/env python3
+import collections
+import threading
 import traceback
 import datetime
 import argparse
+import textwrap
+import weakref
 import struct
-import base64
 import queue
 import time
 import os
@@ -11,13 +14,19 @@ import sys
 
 import simplejson
 
-from alternativa import protocol, util
+from alternativa import protocol, util, model, catalog, profiler, follow, archive, registry, sampling
+from alternativa.quarantine import Quarantine, QUARANTINE_SUFFIX
 
 RECORD_BEGIN = 1
 RECORD_DATA = 2
 RECORD_END = 3
 
+PIPELINE_BATCH = 256
+PIPELINE_DEPTH = 8
+
 class Record():
+    __slots__ = ('rec_type', 'conn_id', 'outgoing', 'time')
+
     def __init__(self, rec_type, conn_id, outgoing, when=None):
         self.rec_type = rec_type
         self.conn_id = conn_id
@@ -29,6 +38,8 @@ class Record():
         f.write(struct.pack('>BH', flags, self.conn_id))
 
 class RecordBegin(Record):
+    __slots__ = ('src_addr', 'dst_addr')
+
     def __init__(self, conn_id, outgoing, src, dst, when=None):
         super().__init__(RECORD_BEGIN, conn_id, outgoing, when=when)
         self.src_addr = src
@@ -44,6 +55,8 @@ class RecordBegin(Record):
         f.write(dst_ip.encode('utf-8'))
 
 class RecordData(Record):
+    __slots__ = ('data',)
+
     def __init__(self, conn_id, outgoing, data, when=None):
         super().__init__(RECORD_DATA, conn_id, outgoing, when=when)
         self.data = data
@@ -54,35 +67,55 @@ class RecordData(Record):
         f.write(self.data)
 
 class RecordEnd(Record):
+    __slots__ = ()
+
     def __init__(self, conn_id, outgoing, when=None):
         super().__init__(RECORD_END, conn_id, outgoing, when=when)
 
 class PacketWriter():
-    def __init__(self, fname):
+    def __init__(self, fname, start=None, autoflush=True, append=False):
         self.fname = fname
-        self.start = time.time()
-        self.start_millis = int(self.start * 1000)
+        self.start = start or time.time()
+        self.start_millis = round(self.start * 1000)
+        self.autoflush = autoflush
+        self.append = append
         self.f = None
 
     def write(self, record):
-        diff = int((record.time - self.start) * 1000)
+        diff = round(record.time * 1000) - self.start_millis
         self.f.write(struct.pack('>I', diff))
         record.write(self.f)
+        if self.autoflush:
+            self.f.flush()
+
+    def flush(self):
         self.f.flush()
 
     def _write_header(self):
-        millis = int(self.start * 1000)
         self.f.write(b'TNK')
-        self.f.write(struct.pack('>Q', millis))
-
-    def __enter__(self):
+        self.f.write(struct.pack('>Q', self.start_millis))
+
+    def open(self):
+        if self.append and os.path.exists(self.fname) and os.path.getsize(self.fname):
+            # record times stay relative to the start time of the existing file
+            with open(self.fname, 'rb') as f:
+                self.start_millis = PacketReader(f).start
+            self.start = self.start_millis / 1000
+            self.f = open(self.fname, 'ab')
+            return self
         self.f = open(self.fname, 'wb')
         self._write_header()
         return self
 
-    def __exit__(self, exc_type, exc_val, exc_tb):
+    def close(self):
         self.f.close()
 
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
 class PacketReader():
     def __init__(self, f):
         file_header = f.read(11)
@@ -109,13 +142,39 @@ class PacketReader():
             return RecordBegin(connection_id, outgoing, (src_ip, src_port), (dst_ip, dst_port), when=time)
         elif record_type == RECORD_DATA:
             length, = struct.unpack('>I', self.f.read(4))
+            if not self._accept(time, connection_id, outgoing):
+                self.f.seek(length, os.SEEK_CUR)
+                return RecordData(connection_id, outgoing, None, when=time)
             return RecordData(connection_id, outgoing, self.f.read(length), when=time)
         elif record_type == RECORD_END:
             return RecordEnd(connection_id, outgoing, when=time)
         else:
             raise ValueError(f'Invalid record type ({record_type})')
 
+    def _accept(self, when, conn_id, outgoing):
+        return True
+
+class RecordFilter():
+    def __init__(self, connections=None, outgoing=None, since=None, until=None):
+        self.connections = connections
+        self.outgoing = outgoing
+        self.since = since
+        self.until = until
+
+    def match(self, when, conn_id, outgoing):
+        if self.connections is not None and conn_id not in self.connections:
+            return False
+        if self.outgoing is not None and outgoing != self.outgoing:
+            return False
+        if self.since is not None and when < self.since:
+            return False
+        if self.until is not None and when > self.until:
+            return False
+        return True
+
 class Event():
+    __slots__ = ('type', 'time', 'connection_id', 'outgoing')
+
     def __init__(self, evt_type, record):
         self.type = evt_type
         self.time = datetime.datetime.utcfromtimestamp(record.time / 1000).isoformat()
@@ -123,9 +182,11 @@ class Event():
         self.outgoing = record.outgoing
 
     def to_dict(self):
-        return self.__dict__.copy()
+        return util.slots_dict(self)
 
 class BeginEvent(Event):
+    __slots__ = ('source', 'destination')
+
     def __init__(self, record):
         super().__init__('begin', record)
         src_ip, src_port = record.src_addr
@@ -134,68 +195,187 @@ class BeginEvent(Event):
         self.destination = f'{dst_ip}:{dst_port}'
 
 class EndEvent(Event):
+    __slots__ = ()
+
     def __init__(self, record):
         super().__init__('end', record)
 
 class CommandEvent(Event):
+    __slots__ = ('record_id', 'command')
+
     def __init__(self, record, record_id, command):
         super().__init__('command', record)
         self.record_id = record_id
-        self.command = command.__dict__
+        self.command = command
 
     def to_dict(self):
         data = super().to_dict()
-        data.update(data.pop('command'))
+        data.update(data.pop('command').to_dict())
         return data
 
 class ProtocolEventReader(PacketReader):
-    def __init__(self, f):
+    def __init__(self, f, cache_size=0, models=None, objects=None, records=None, profiler=None, registry=None, sampler=None, quarantine=None, reader=None):
         super().__init__(f)
         self.control = [
             protocol.ServerControlCommandDecoder(),
             protocol.ClientControlCommandDecoder()
         ]
-        self.space = protocol.SpaceCommandDecoder()
+        self.models = models
+        self.objects = objects
+        self.profiler = profiler
+        self.sampler = sampler
+        self.space = protocol.SpaceCommandDecoder(models, objects, reader, sampler)
+        if profiler:
+            profiler.instrument(self.space)
+        self.records = records
+        # identical packets are decoded once, a sampled packet depends on what came before it and is never cached
+        self.cache = protocol.DecodeCache(cache_size) if cache_size and not sampler else None
         self.in_space = dict()
         self.queue = list()
         self.i = 0
+        # connections whose protocol hash has its own codecs in the registry
+        self.registry = registry
+        self.spaces = dict()
+        self.decoders = weakref.WeakValueDictionary()
+        self.unknown = set()
+        # commands that fail to decode are recorded there instead of in the event stream
+        self.quarantine = quarantine or Quarantine()
+
+    def _open_space(self, conn_id, command):
+        self.in_space[conn_id] = True
+        self.spaces.pop(conn_id, None)
+        if self.registry is None or not command.data:
+            return
+        prot_hash = command.data['hash']
+        if prot_hash in self.unknown:
+            return
+        try:
+            reader = self.registry.reader(prot_hash)
+        except Exception:
+            traceback.print_exc()
+            reader = None
+        if reader is None:
+            self.unknown.add(prot_hash)
+            print(f'No codecs for protocol {prot_hash}, using the default codecs', file=sys.stderr)
+            return
+        # decoders live as long as a connection uses them, the registry decides when the codecs are unloaded
+        decoder = self.decoders.get(id(reader))
+        if decoder is None:
+            decoder = protocol.SpaceCommandDecoder(self.models, self.objects, reader, self.sampler)
+            if self.profiler:
+                self.profiler.instrument(decoder)
+            self.decoders[id(reader)] = decoder
+        self.spaces[conn_id] = (prot_hash, decoder)
+
+    def _accept(self, when, conn_id, outgoing):
+        # control packets are always decoded to follow connection upgrades
+        if self.records is None or not self.in_space.get(conn_id):
+            return True
+        return self.records.match(when, conn_id, outgoing)
 
     def _next_record(self):
-        record = super().__next__()
+        self.feed(super().__next__())
+
+    def feed(self, record):
+        # records read elsewhere (see Pipeline) were not filtered by _accept
+        matched = self.records is None or self.records.match(record.time, record.conn_id, record.outgoing)
         if record.rec_type == RECORD_BEGIN:
             self.in_space[record.conn_id] = False
-            self.queue.append(BeginEvent(record))
+            self.spaces.pop(record.conn_id, None)
+            if matched:
+                self.queue.append(BeginEvent(record))
         elif record.rec_type == RECORD_END:
-            self.queue.append(EndEvent(record))
-        elif record.rec_type == RECORD_DATA:
+            self.spaces.pop(record.conn_id, None)
+            if matched:
+                self.queue.append(EndEvent(record))
+        elif record.rec_type == RECORD_DATA and record.data is not None and (matched or not self.in_space.get(record.conn_id)):
             packet = util.ByteArray(record.data)
             optional_map = protocol.decode_null_map(packet)
             space_conn = self.in_space[record.conn_id]
-            decoder = self.space if space_conn else self.control[record.outgoing]
+            version, space = self.spaces.get(record.conn_id, (None, self.space))
+            if self.sampler:
+                self.sampler.time = record.time
+            key = None
+            if space_conn and self.cache:
+                key = (version,) + self.cache.key(packet)
+                cached = self.cache.get(key)
+                if cached is not None:
+                    for command in cached:
+                        self.queue.append(CommandEvent(record, self.i, command))
+                    self.i += 1
+                    return
+
+            decoder = space if space_conn else self.control[record.outgoing]
+            commands = list()
+            failed = False
             while packet.bytesAvailable():
+                start, bit = packet.position, optional_map.position
                 try:
                     command = decoder.decode(packet, optional_map)
-                except:
-                    traceback.print_exc()
-                    dummy = protocol.SpaceCommand(None, None)
-                    dummy.data = base64.b64encode(packet.data).decode()
-                    self.queue.append(CommandEvent(record, self.i, dummy))
-                    return
+                except Exception as e:
+                    # the rest of the packet is kept when a known command can be found after the broken one
+                    resynced = space_conn and decoder.resync(packet, optional_map, start, bit)
+                    dummy = self._quarantine(record, packet, start, e, resynced)
+                    if matched:
+                        self.queue.append(CommandEvent(record, self.i, dummy))
+                    failed = True
+                    if resynced:
+                        continue
+                    break
+
+                if command is None:
+                    continue
 
                 # upgrade connection if necessary
                 if not space_conn and command.command_id == 3:
-                    self.in_space[record.conn_id] = True
+                    self._open_space(record.conn_id, command)
 
                 # prevent leaking sensitive information
-                if space_conn and command.data['codec'] == 'LoginModelServer_login':
-                    command.data['password'] = '*' * 12
+                if space_conn and model.codec_name(command.data) == 'LoginModelServer_login':
+                    command.data = model.replace(command.data, 'password', '*' * 12)
+
+                # cached commands are shared by every later hit
+                if key:
+                    command.data = model.freeze(command.data)
 
-                self.queue.append(CommandEvent(record, self.i, command))
+                commands.append(command)
+                if matched:
+                    self.queue.append(CommandEvent(record, self.i, command))
+
+            assert packet.bytesAvailable() == 0 or failed
+            if key and not failed:
+                self.cache.put(key, tuple(commands))
 
-            assert packet.bytesAvailable() == 0
-        
         self.i += 1
 
+    def _quarantine(self, record, packet, start, error, resynced):
+        buf = packet.data
+        object_id = method_id = None
+        if self.in_space[record.conn_id] and len(buf) - start >= 16:
+            object_id, method_id = struct.unpack_from('>QQ', buf, start)
+        end = packet.position if resynced else len(buf)
+        # the raw bytes are referenced by record id, see --bin and --raw --entry
+        message = f'{type(error).__name__}: {error}'
+        self.quarantine.add(
+            (type(error).__name__, method_id),
+            message if method_id is None or isinstance(error, protocol.UnknownModelError) else f'{message} in method {method_id}',
+            {
+                'record_id': self.i,
+                'time': record.time,
+                'connection_id': record.conn_id,
+                'offset': start,
+                'length': end - start,
+                'object_id': object_id,
+                'method_id': method_id,
+                'error': message,
+                'resynced': bool(resynced)
+            },
+            f'Record {self.i}: '
+        )
+        dummy = protocol.SpaceCommand(object_id, None)
+        dummy.data = {'error': str(error), 'offset': start, 'length': end - start}
+        return dummy
+
     def __iter__(self):
         return self
 
@@ -204,55 +384,387 @@ class ProtocolEventReader(PacketReader):
             self._next_record()
         return self.queue.pop(0)
 
-def dump_contents(fname):
+class TrafficStats(ProtocolEventReader):
+    def __init__(self, f, bucket=60, records=None, registry=None):
+        super().__init__(f, records=records, registry=registry)
+        self.bucket = bucket * 1000
+        # [packets or commands, bytes] per key
+        self.methods = collections.defaultdict(lambda: [0, 0])
+        self.control_commands = collections.defaultdict(lambda: [0, 0])
+        self.directions = collections.defaultdict(lambda: [0, 0])
+        self.buckets = collections.defaultdict(lambda: [0, 0])
+        self.connections = dict()
+        self.errors = 0
+
+    def _next_record(self):
+        record = PacketReader.__next__(self)
+        if record.rec_type == RECORD_BEGIN:
+            self.in_space[record.conn_id] = False
+        if record.rec_type != RECORD_DATA or record.data is None:
+            return
+        if self.records is not None and not self.records.match(record.time, record.conn_id, record.outgoing):
+            # control packets of filtered connections are still decoded to follow upgrades
+            if not self.in_space.get(record.conn_id):
+                self._count_control(record, False)
+            return
+
+        length = len(record.data)
+        for counter in (self.directions['out' if record.outgoing else 'in'], self.buckets[record.time - record.time % self.bucket]):
+            counter[0] += 1
+            counter[1] += length
+        connection = self.connections.get(record.conn_id)
+        if connection is None:
+            connection = self.connections[record.conn_id] = {'packets': 0, 'bytes': 0, 'commands': 0, 'first': record.time, 'last': record.time}
+        connection['packets'] += 1
+        connection['bytes'] += length
+        connection['last'] = record.time
+
+        if self.in_space.get(record.conn_id):
+            connection['commands'] += self._count_space(record)
+        else:
+            connection['commands'] += self._count_control(record, True)
+
+    def _count_control(self, record, counted):
+        packet = util.ByteArray(record.data)
+        optional = protocol.decode_null_map(packet)
+        decoder = self.control[record.outgoing]
+        commands = 0
+        try:
+            while packet.bytesAvailable():
+                position = packet.position
+                command = decoder.decode(packet, optional)
+                if command.command_id == 3:
+                    self._open_space(record.conn_id, command)
+                if counted:
+                    stats = self.control_commands[decoder.types.get(command.command_id, command.command_id)]
+                    stats[0] += 1
+                    stats[1] += packet.position - position
+                commands += 1
+        except Exception:
+            if counted:
+                self.errors += 1
+        return commands
+
+    def _count_space(self, record):
+        # skipping is enough to find the command boundaries, nothing is decoded into objects
+        packet = util.ByteArray(record.data)
+        optional = protocol.decode_null_map(packet)
+        _, space = self.spaces.get(record.conn_id, (None, self.space))
+        commands = 0
+        while packet.bytesAvailable():
+            position = packet.position
+            try:
+                _, method_id = space.skip(packet, optional)
+            except Exception:
+                self.errors += 1
+                return commands
+            stats = self.methods[method_id]
+            stats[0] += 1
+            stats[1] += packet.position - position
+            commands += 1
+        return commands
+
+    def collect(self):
+        try:
+            while True:
+                self._next_record()
+        except StopIteration:
+            pass
+        return self
+
+    def to_dict(self):
+        ranked = sorted(self.methods.items(), key=lambda x: x[1][1], reverse=True)
+        connections = dict()
+        for conn_id, connection in sorted(self.connections.items()):
+            duration = (connection['last'] - connection['first']) / 1000
+            connections[str(conn_id)] = dict(connection, bytes_per_s=connection['bytes'] / duration if duration else 0)
+        return {
+            'methods': {str(method_id): {'codec': self.space.reader.get_codec_name(method_id), 'commands': count, 'bytes': nbytes}
+                for method_id, (count, nbytes) in ranked},
+            'control': {str(name): {'commands': count, 'bytes': nbytes} for name, (count, nbytes) in self.control_commands.items()},
+            'connections': connections,
+            'directions': {direction: {'packets': count, 'bytes': nbytes} for direction, (count, nbytes) in self.directions.items()},
+            'buckets': {datetime.datetime.utcfromtimestamp(start / 1000).isoformat(): {'packets': count, 'bytes': nbytes}
+                for start, (count, nbytes) in sorted(self.buckets.items())},
+            'errors': self.errors
+        }
+
+    def report(self, n=20):
+        stats = self.to_dict()
+        lines = [f'{"method_id":>20} {"codec":<40} {"commands":>9} {"bytes":>11} {"avg":>8}']
+        for method_id, method in list(stats['methods'].items())[:n]:
+            lines.append(f'{method_id:>20} {str(method["codec"])[:40]:<40} {method["commands"]:>9} {method["bytes"]:>11} '
+                f'{method["bytes"] / method["commands"]:>8.1f}')
+        for name, command in stats['control'].items():
+            lines.append(f'{"control":>20} {name[:40]:<40} {command["commands"]:>9} {command["bytes"]:>11}')
+        lines.append('')
+        lines.append(f'{"conn":>6} {"packets":>9} {"commands":>9} {"bytes":>11} {"bytes/s":>10}')
+        for conn_id, connection in stats['connections'].items():
+            lines.append(f'{conn_id:>6} {connection["packets"]:>9} {connection["commands"]:>9} {connection["bytes"]:>11} '
+                f'{connection["bytes_per_s"]:>10.0f}')
+        lines.append('')
+        for direction, counter in stats['directions'].items():
+            lines.append(f'{direction:>3}: {counter["packets"]} packets, {counter["bytes"]} bytes')
+        lines.append('')
+        lines.append(f'{"bucket":<20} {"packets":>9} {"bytes":>11}')
+        for start, counter in stats['buckets'].items():
+            lines.append(f'{start:<20} {counter["packets"]:>9} {counter["bytes"]:>11}')
+        lines.append(f'{stats["errors"]} packets could not be split into commands')
+        return '\n'.join(lines)
+
+def dump_stats(fname, as_json=False, bucket=60, top=20, records=None, registry=None):
     with open(fname, 'rb') as f:
-        reader = ProtocolEventReader(f)
-        date = datetime.datetime.fromtimestamp(reader.start / 1000)
-        print('Recording begins at', date)
-        for event in reader:
-            if event.type == 'begin':
-                print(f'[{event.connection_id}] {event.source} -> {event.destination}')
-            elif event.type == 'command':
-                prefix = 'CL' if event.outgoing else 'SV'
-                print(f'[{event.connection_id}] {prefix}>', simplejson.dumps(event.command))
+        stats = TrafficStats(f, bucket, records, registry).collect()
+    if as_json:
+        print(simplejson.dumps(stats.to_dict(), indent=4))
+    else:
+        print(stats.report(top))
+
+class StageStats():
+    __slots__ = ('name', 'items', 'start', 'end', 'starved', 'blocked')
+
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.start = 0.0
+        self.end = 0.0
+        self.starved = 0.0
+        self.blocked = 0.0
+
+    def busy(self):
+        return self.end - self.start - self.starved - self.blocked
+
+class Pipeline():
+    def __init__(self, f, write, batch=PIPELINE_BATCH, depth=PIPELINE_DEPTH, **options):
+        # the decoder only parses the header, records are read by the reader thread from its own handle
+        self.fname = f.name
+        self.decoder = ProtocolEventReader(f, **options)
+        self.write = write
+        self.batch = batch
+        self.records = queue.Queue(depth)
+        self.events = queue.Queue(depth)
+        self.stages = {name: StageStats(name) for name in ('read', 'decode', 'write')}
+        self.errors = list()
+        self.elapsed = 0.0
+
+    def _get(self, items, stats):
+        start = time.perf_counter()
+        item = items.get()
+        stats.starved += time.perf_counter() - start
+        return item
+
+    def _put(self, items, item, stats):
+        start = time.perf_counter()
+        items.put(item)
+        stats.blocked += time.perf_counter() - start
+
+    def _read(self):
+        stats = self.stages['read']
+        stats.start = time.perf_counter()
+        try:
+            with open(self.fname, 'rb') as f:
+                batch = list()
+                for record in PacketReader(f):
+                    batch.append(record)
+                    if len(batch) >= self.batch:
+                        stats.items += len(batch)
+                        self._put(self.records, batch, stats)
+                        batch = list()
+                stats.items += len(batch)
+                self._put(self.records, batch, stats)
+        except BaseException as e:
+            self.errors.append(e)
+        finally:
+            stats.end = time.perf_counter()
+            self.records.put(None)
+
+    def _write(self):
+        stats = self.stages['write']
+        stats.start = time.perf_counter()
+        failed = False
+        while True:
+            events = self._get(self.events, stats)
+            if events is None:
+                break
+            if failed:
+                # keep draining so the decode stage never blocks on a full queue
+                continue
+            try:
+                self.write(events)
+            except BaseException as e:
+                self.errors.append(e)
+                failed = True
+            stats.items += len(events)
+        stats.end = time.perf_counter()
+
+    def run(self):
+        reader = threading.Thread(target=self._read, name='PipelineReader', daemon=True)
+        writer = threading.Thread(target=self._write, name='PipelineWriter', daemon=True)
+        stats = self.stages['decode']
+        stats.start = time.perf_counter()
+        reader.start()
+        writer.start()
+        batch = list()
+        try:
+            while True:
+                batch = self._get(self.records, stats)
+                if batch is None:
+                    break
+                for record in batch:
+                    self.decoder.feed(record)
+                stats.items += len(batch)
+                # one queue item per batch, events keep the order of their records
+                events, self.decoder.queue = self.decoder.queue, list()
+                if events:
+                    self._put(self.events, events, stats)
+        finally:
+            while batch is not None:
+                batch = self.records.get()
+            self.events.put(None)
+            stats.end = time.perf_counter()
+            reader.join()
+            writer.join()
+            self.elapsed = time.perf_counter() - stats.start
+        if self.errors:
+            raise self.errors[0]
+
+    def report(self):
+        lines = [f'{"stage":<8} {"items":>9} {"busy s":>8} {"starved s":>10} {"blocked s":>10} {"util %":>7}']
+        for stats in self.stages.values():
+            busy = stats.busy()
+            lines.append(f'{stats.name:<8} {stats.items:>9} {busy:>8.2f} {stats.starved:>10.2f} {stats.blocked:>10.2f} '
+                f'{busy * 100 / self.elapsed if self.elapsed else 0:>7.1f}')
+        return '\n'.join(lines)
+
+class EventWriter():
+    def __init__(self, out, as_json=False):
+        self.out = out
+        self.as_json = as_json
+        self.count = 0
+
+    def __call__(self, events):
+        chunks = list()
+        for event in events:
+            if self.as_json:
+                # same layout as dumping the whole list at once in dump_json
+                text = simplejson.dumps(event.to_dict(), indent=4, ignore_nan=True)
+                chunks.append(',\n' if self.count else '[\n')
+                chunks.append(textwrap.indent(text, '    '))
+            else:
+                line = format_event(event)
+                if line is not None:
+                    chunks.append(line + '\n')
+            self.count += 1
+        self.out.write(''.join(chunks))
+
+    def close(self):
+        if self.as_json:
+            self.out.write('\n]\n' if self.count else '[]\n')
+
+def print_cache_stats(reader):
+    if reader.cache:
+        stats = reader.cache.stats()
+        print('Decode cache:', ', '.join(f'{k}={v}' for k, v in stats.items()), file=sys.stderr)
+
+def format_event(event):
+    if event.type == 'begin':
+        return f'[{event.connection_id}] {event.source} -> {event.destination}'
+    if event.type == 'command':
+        prefix = 'CL' if event.outgoing else 'SV'
+        return f'[{event.connection_id}] {prefix}> {simplejson.dumps(event.command.to_dict())}'
+    return None
+
+def dump_contents(fname, tail=False, **options):
+    with open(fname, 'rb') as f:
+        # a tailed file waits for the writer at EOF instead of ending the iteration
+        source = follow.FollowFile(f) if tail else f
+        try:
+            reader = ProtocolEventReader(source, **options)
+            date = datetime.datetime.fromtimestamp(reader.start / 1000)
+            print('Recording begins at', date, flush=tail)
+            for event in reader:
+                line = format_event(event)
+                if line is not None:
+                    print(line, flush=tail)
+            print_cache_stats(reader)
+        finally:
+            source.close()
+
+def follow_json(fname, **options):
+    # one event per line, a json array would never be closed
+    with open(fname, 'rb') as f:
+        source = follow.FollowFile(f)
+        try:
+            for event in ProtocolEventReader(source, **options):
+                print(simplejson.dumps(event.to_dict(), ignore_nan=True), flush=True)
+        finally:
+            source.close()
 
-def dump_json(fname):
+def dump_json(fname, **options):
     events = list()
     with open(fname, 'rb') as f:
-        reader = ProtocolEventReader(f)
+        reader = ProtocolEventReader(f, **options)
         try:
             for event in reader:
                 events.append(event.to_dict())
         except:
             traceback.print_exc()
+    print_cache_stats(reader)
     print(simplejson.dumps(events, indent=4, ignore_nan=True))
 
-def dump_bin(fname):
-    os.makedirs('dump', exist_ok=True)
+def dump_pipeline(fname, as_json=False, batch=PIPELINE_BATCH, **options):
+    writer = EventWriter(sys.stdout, as_json)
+    with open(fname, 'rb') as f:
+        pipeline = Pipeline(f, writer, batch, **options)
+        if not as_json:
+            print('Recording begins at', datetime.datetime.fromtimestamp(pipeline.decoder.start / 1000))
+        try:
+            pipeline.run()
+        except:
+            traceback.print_exc()
+    writer.close()
+    print_cache_stats(pipeline.decoder)
+    print(pipeline.report(), file=sys.stderr)
+
+def dump_catalog(fname, catalog_file):
+    resources = catalog.ResourceCatalog()
+    if os.path.isfile(catalog_file):
+        resources = catalog.ResourceCatalog.load(catalog_file)
+    known = len(resources)
     with open(fname, 'rb') as f:
+        reader = ProtocolEventReader(f)
+        for event in reader:
+            resources.add_event(event)
+    resources.save(catalog_file)
+    print(f'Saved {len(resources)} resources ({len(resources) - known} new) to {catalog_file}')
+
+def dump_bin(fname, output='dump.pak'):
+    # one archive instead of a file per packet, see alternativa.archive for listing and extracting
+    with open(fname, 'rb') as f, archive.PayloadArchiveWriter(output) as w:
         i = 0
         reader = PacketReader(f)
         for record in reader:
             if record.rec_type == RECORD_DATA:
                 packet = util.ByteArray(record.data)
                 protocol.decode_null_map(packet)
-                length = packet.position
-                packet.position = 0
-                raw_optional = list(packet.readBytes(length))
-                with open(f'dump/{i}.bin', 'wb') as f:
-                    f.write(packet.readBytes())
-                print(f'Saved {i}.bin, optional={raw_optional}')
+                w.add(i, record.data[:packet.position], record.data[packet.position:])
             i += 1
+    print(f'Saved {len(w.index)} packets to {output}')
 
-def dump_raw(fname):
-    with open(fname, 'rb') as f:
-        packet = util.ByteArray(f.read())
+def dump_raw(fname, entry=None):
+    if entry is None:
+        with open(fname, 'rb') as f:
+            packet = util.ByteArray(f.read())
+    else:
+        packets = archive.PayloadArchive(fname)
+        packet = util.ByteArray(packets.raw(entry))
+        packets.close()
     optional = protocol.decode_null_map(packet)
     print(optional)
     space = protocol.SpaceCommandDecoder()
     while packet.bytesAvailable():
         command = space.decode(packet, optional)
-        print(simplejson.dumps(command.__dict__, indent=4, ignore_nan=True))
+        print(simplejson.dumps(command.to_dict(), indent=4, ignore_nan=True))
 
 def dump_with_null_map(fname, optional):
     with open(fname, 'rb') as f:
@@ -260,32 +772,124 @@ def dump_with_null_map(fname, optional):
     space = protocol.SpaceCommandDecoder()
     while packet.bytesAvailable():
         command = space.decode(packet, optional)
-        print(simplejson.dumps(command.__dict__, indent=4, ignore_nan=True))
+        print(simplejson.dumps(command.to_dict(), indent=4, ignore_nan=True))
+
+def parse_time(value):
+    try:
+        return int(float(value) * 1000)
+    except ValueError:
+        pass
+    # event times are printed in UTC
+    date = datetime.datetime.fromisoformat(value)
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=datetime.timezone.utc)
+    return int(date.timestamp() * 1000)
+
+def print_quarantine(options):
+    errors = options['quarantine']
+    errors.close()
+    if errors.count:
+        print(f'{errors.count} commands failed to decode, see {errors.fname}', file=sys.stderr)
+
+def print_sampling(options):
+    sampler = options.get('sampler')
+    if sampler:
+        print('Sampling:', ', '.join(f'{k}={v}' for k, v in sampler.stats().items()), file=sys.stderr)
+
+def print_profile(args, options):
+    profile = options.get('profiler')
+    if not profile:
+        return
+    print(profile.report(args.profile), file=sys.stderr)
+    if args.profile_json:
+        with open(args.profile_json, 'w') as f:
+            simplejson.dump(profile.to_dict(), f, indent=4)
+
+def reader_options(args):
+    options = {'cache_size': args.cache, 'quarantine': Quarantine(args.quarantine or args.filename + QUARANTINE_SUFFIX)}
+    if args.profile or args.profile_json:
+        options['profiler'] = profiler.Profiler()
+    if args.model:
+        options['models'] = set(args.model)
+    if args.object:
+        options['objects'] = set(args.object)
+    if args.registry:
+        options['registry'] = registry.CodecRegistry(args.registry)
+    if args.sample:
+        policy, argument = args.sample
+        options['sampler'] = policy(argument, set(args.sample_model) if args.sample_model else None)
+    if args.conn or args.direction or args.since or args.until:
+        options['records'] = RecordFilter(
+            connections=set(args.conn) if args.conn else None,
+            outgoing=None if args.direction is None else args.direction == 'out',
+            since=parse_time(args.since) if args.since else None,
+            until=parse_time(args.until) if args.until else None
+        )
+    return options
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('filename')
     parser.add_argument('-j', '--json', action='store_true', help='output as json')
-    parser.add_argument('-b', '--bin', action='store_true', help='output a binary file for each packet')
+    parser.add_argument('-b', '--bin', nargs='?', const='dump.pak', metavar='ARCHIVE', help='write all packets to a payload archive')
     parser.add_argument('-r', '--raw', action='store_true', help='read file as raw packet with embedded null map')
+    parser.add_argument('-e', '--entry', type=int, metavar='ID', help='with --raw, read this packet from a payload archive')
     parser.add_argument('-n', '--null', nargs=1, help='read file as raw packet with provided null map')
+    parser.add_argument('--cache', type=int, default=0, metavar='N', help='cache decoded commands of the last N distinct packets')
+    parser.add_argument('--conn', type=int, action='append', help='only show this connection id')
+    parser.add_argument('--direction', choices=('in', 'out'), help='only show incoming or outgoing packets')
+    parser.add_argument('--since', help='only show records after this time (ISO 8601 UTC or unix seconds)')
+    parser.add_argument('--until', help='only show records before this time (ISO 8601 UTC or unix seconds)')
+    parser.add_argument('--model', type=lambda x: int(x, 0), action='append', help='only decode commands with this method id')
+    parser.add_argument('--object', type=lambda x: int(x, 0), action='append', help='only decode commands for this object id')
+    parser.add_argument('--profile', type=int, nargs='?', const=20, metavar='N', help='report the N slowest models')
+    parser.add_argument('--profile-json', metavar='FILE', help='write per-model decode statistics as json')
+    parser.add_argument('-c', '--catalog', metavar='FILE', help='add resources to a resource catalog file')
+    parser.add_argument('--registry', metavar='DIR', help='pick codecs by protocol hash from a codec registry')
+    parser.add_argument('-f', '--follow', action='store_true', help='keep decoding while the dump is being written')
+    parser.add_argument('--pipeline', type=int, nargs='?', const=PIPELINE_BATCH, metavar='BATCH', help='read, decode and write on separate threads, passing records in batches')
+    parser.add_argument('-s', '--stats', type=int, nargs='?', const=20, metavar='N', help='count traffic per model, connection and time, listing the N largest models')
+    parser.add_argument('--bucket', type=int, default=60, metavar='SECONDS', help='time bucket size for --stats')
+    parser.add_argument('--sample', type=sampling.parse_policy, metavar='POLICY', help='keep every:N commands per object and method, one per interval:SECONDS or those that change:DELTA')
+    parser.add_argument('--quarantine', metavar='FILE', help='record commands that fail to decode in FILE instead of <dump>.quarantine')
+    parser.add_argument('--sample-model', type=lambda x: int(x, 0), action='append', metavar='ID', help='only sample commands with this method id')
     args = parser.parse_args()
     if not os.path.isfile(args.filename):
         parser.error(f'{args.filename} not found')
         sys.exit(1)
+    if (args.profile or args.profile_json) and (args.bin or args.raw or args.null or args.catalog or args.stats is not None):
+        parser.error('--profile only works when decoding a dump')
 
-    if args.json:
-        dump_json(args.filename)
+    options = reader_options(args)
+    if args.stats is not None:
+        dump_stats(args.filename, args.json, args.bucket, args.stats, options.get('records'), options.get('registry'))
+    elif args.follow:
+        try:
+            if args.json:
+                follow_json(args.filename, **options)
+            else:
+                dump_contents(args.filename, tail=True, **options)
+        except KeyboardInterrupt:
+            pass
+    elif args.pipeline:
+        dump_pipeline(args.filename, args.json, args.pipeline, **options)
+    elif args.json:
+        dump_json(args.filename, **options)
     elif args.bin:
-        dump_bin(args.filename)
+        dump_bin(args.filename, args.bin)
+    elif args.catalog:
+        dump_catalog(args.filename, args.catalog)
     elif args.raw:
-        dump_raw(args.filename)
+        dump_raw(args.filename, args.entry)
     elif args.null:
         nulls = bytearray([int(x, 0) for x in args.null[0].split(',')])
         null_map = protocol.decode_null_map(util.ByteArray(nulls))
         dump_with_null_map(args.filename, null_map)
     else:
-        dump_contents(args.filename)
+        dump_contents(args.filename, **options)
+    print_quarantine(options)
+    print_sampling(options)
+    print_profile(args, options)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,97 @@
+import argparse
+import struct
+import mmap
+import os
+
+ARCHIVE_MAGIC = b'TPA'
+ENTRY_FORMAT = '>IQII'
+FOOTER_FORMAT = '>QI'
+
+class PayloadArchiveWriter():
+    def __init__(self, fname):
+        self.fname = fname
+        self.index = list()
+        self.f = None
+
+    def add(self, record_id, null_map, body):
+        self.index.append((record_id, bytes(null_map), self.f.tell(), len(body)))
+        self.f.write(body)
+
+    def __enter__(self):
+        self.f = open(self.fname, 'wb')
+        self.f.write(ARCHIVE_MAGIC)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        # the index goes last so payloads can be streamed without knowing their number
+        index_offset = self.f.tell()
+        for record_id, null_map, offset, length in self.index:
+            self.f.write(struct.pack(ENTRY_FORMAT, record_id, offset, length, len(null_map)))
+            self.f.write(null_map)
+        self.f.write(struct.pack(FOOTER_FORMAT, index_offset, len(self.index)))
+        self.f.close()
+
+class PayloadArchive():
+    def __init__(self, fname):
+        with open(fname, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:3] != ARCHIVE_MAGIC:
+            raise ValueError('Invalid magic')
+        footer_size = struct.calcsize(FOOTER_FORMAT)
+        index_offset, count = struct.unpack_from(FOOTER_FORMAT, self.map, len(self.map) - footer_size)
+        entry_size = struct.calcsize(ENTRY_FORMAT)
+        self.entries = dict()
+        position = index_offset
+        for _ in range(count):
+            record_id, offset, length, null_length = struct.unpack_from(ENTRY_FORMAT, self.map, position)
+            position += entry_size
+            self.entries[record_id] = (self.map[position:position + null_length], offset, length)
+            position += null_length
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, record_id):
+        return record_id in self.entries
+
+    def null_map(self, record_id):
+        return self.entries[record_id][0]
+
+    def body(self, record_id):
+        _, offset, length = self.entries[record_id]
+        return memoryview(self.map)[offset:offset + length]
+
+    def raw(self, record_id):
+        # the packet as it was recorded, readable like a file given to altdump --raw
+        null_map, offset, length = self.entries[record_id]
+        return null_map + self.map[offset:offset + length]
+
+    def extract(self, directory, record_ids=None):
+        os.makedirs(directory, exist_ok=True)
+        for record_id in record_ids or sorted(self.entries):
+            with open(os.path.join(directory, f'{record_id}.bin'), 'wb') as f:
+                f.write(self.body(record_id))
+            yield record_id
+
+    def close(self):
+        self.map.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='List or extract the packets of a payload archive.')
+    parser.add_argument('filename', help='payload archive written by altdump --bin')
+    parser.add_argument('ids', type=int, nargs='*', help='record ids, all by default')
+    parser.add_argument('-x', '--extract', metavar='DIR', help='write each packet body to DIR/<id>.bin')
+    args = parser.parse_args()
+
+    archive = PayloadArchive(args.filename)
+    if args.extract:
+        for record_id in archive.extract(args.extract, args.ids):
+            print(f'Saved {record_id}.bin, optional={list(archive.null_map(record_id))}')
+    else:
+        for record_id in args.ids or sorted(archive.entries):
+            null_map, _, length = archive.entries[record_id]
+            print(f'{record_id}: {length} bytes, optional={list(null_map)}')
+    archive.close()
+
+if __name__ == '__main__':
+    main()
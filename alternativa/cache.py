@@ -0,0 +1,202 @@
+import concurrent.futures
+import collections
+import urllib.request
+import urllib.error
+import threading
+import argparse
+import hashlib
+import json
+import os
+
+from alternativa import loader, catalog
+
+INDEX_FILE = 'index.json'
+CHUNK_SIZE = 1 << 16
+
+class ResourceCache():
+    def __init__(self, root, base=loader.RESOURCE_BASE, max_size=None, workers=8, timeout=30):
+        self.root = root
+        self.base = base
+        self.max_size = max_size
+        self.workers = workers
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.missing = set()
+        self.size = 0
+        # relative path -> (size, sha256), oldest first
+        self.entries = collections.OrderedDict()
+        self._load_index()
+
+    def _load_index(self):
+        os.makedirs(self.root, exist_ok=True)
+        try:
+            with open(os.path.join(self.root, INDEX_FILE), 'r') as f:
+                index = json.load(f)
+        except FileNotFoundError:
+            return
+        for path, size, digest in index:
+            try:
+                valid = os.path.getsize(os.path.join(self.root, path)) == size
+            except OSError:
+                valid = False
+            if valid:
+                self.entries[path] = (size, digest)
+                self.size += size
+
+    def save_index(self):
+        with self.lock:
+            index = [(path, size, digest) for path, (size, digest) in self.entries.items()]
+        tmp = os.path.join(self.root, INDEX_FILE + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp, os.path.join(self.root, INDEX_FILE))
+
+    def key_path(self, resource_id, version, fname):
+        return loader.get_resource_path(resource_id, version)[1:] + fname
+
+    def lookup(self, resource_id, version, fname):
+        path = self.key_path(resource_id, version, fname)
+        with self.lock:
+            if path not in self.entries:
+                return None
+            self.entries.move_to_end(path)
+        return os.path.join(self.root, path)
+
+    def get(self, resource_id, version, fname):
+        cached = self.lookup(resource_id, version, fname)
+        if cached or self.key_path(resource_id, version, fname) in self.missing:
+            return cached
+        target = self.fetch(resource_id, version, fname)
+        # single lookups keep the index current, prefetch saves it once at the end
+        if target:
+            self.save_index()
+        return target
+
+    def fetch(self, resource_id, version, fname):
+        path = self.key_path(resource_id, version, fname)
+        target = os.path.join(self.root, path)
+        url = ''.join((self.base, '/', path))
+        tmp = f'{target}.{threading.get_ident()}.tmp'
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        complete = False
+        try:
+            with urllib.request.urlopen(url, timeout=self.timeout) as r, open(tmp, 'wb') as f:
+                expected = r.headers.get('Content-Length')
+                for chunk in iter(lambda: r.read(CHUNK_SIZE), b''):
+                    digest.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+            if expected is not None and int(expected) != size:
+                raise IOError(f'Truncated download of {url} ({size}/{expected} bytes)')
+            complete = True
+        except urllib.error.HTTPError as e:
+            if e.code != 404:
+                raise
+            self.missing.add(path)
+            return None
+        finally:
+            if not complete and os.path.exists(tmp):
+                os.remove(tmp)
+
+        # files are only replaced and removed under the lock, so eviction cannot delete a fresh download
+        with self.lock:
+            os.replace(tmp, target)
+            if path in self.entries:
+                self.size -= self.entries[path][0]
+            self.entries[path] = (size, digest.hexdigest())
+            self.size += size
+            self._evict(keep=path)
+        return target
+
+    def verify(self, resource_id=None, version=None, fname=None):
+        with self.lock:
+            if resource_id is None:
+                paths = list(self.entries)
+            else:
+                paths = [self.key_path(resource_id, version, fname)]
+        corrupt = list()
+        for path in paths:
+            digest = hashlib.sha256()
+            try:
+                with open(os.path.join(self.root, path), 'rb') as f:
+                    for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                        digest.update(chunk)
+            except OSError:
+                pass
+            with self.lock:
+                if path in self.entries and self.entries[path][1] != digest.hexdigest():
+                    size, _ = self.entries.pop(path)
+                    self.size -= size
+                    corrupt.append(path)
+        return corrupt
+
+    def evict(self):
+        with self.lock:
+            self._evict()
+
+    def _evict(self, keep=None):
+        # oldest first, the file just fetched for a caller stays even if it alone exceeds the budget
+        if self.max_size is None:
+            return
+        for path in list(self.entries):
+            if self.size <= self.max_size:
+                break
+            if path == keep:
+                continue
+            size, _ = self.entries.pop(path)
+            self.size -= size
+            try:
+                os.remove(os.path.join(self.root, path))
+            except FileNotFoundError:
+                pass
+
+    def close(self):
+        self.save_index()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def prefetch(self, resources):
+        stats = collections.Counter()
+        jobs = list()
+        for resource_id, version, resource_type in resources:
+            for fname in loader.FILES_BY_TYPE.get(resource_type, ()):
+                if self.lookup(resource_id, version, fname):
+                    stats['cached'] += 1
+                else:
+                    jobs.append((resource_id, version, fname))
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = [pool.submit(self.fetch, *job) for job in jobs]
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    stats['fetched' if future.result() else 'missing'] += 1
+                except (IOError, urllib.error.URLError):
+                    stats['failed'] += 1
+
+        self.save_index()
+        return stats
+
+def main():
+    parser = argparse.ArgumentParser(description='Prefetch catalog resources into a local cache.')
+    parser.add_argument('catalog', help='resource catalog file')
+    parser.add_argument('root', nargs='?', default='resources', help='cache directory')
+    parser.add_argument('-b', '--base', default=loader.RESOURCE_BASE, help='resource server base URL')
+    parser.add_argument('-s', '--max-size', type=int, help='cache size budget in MB')
+    parser.add_argument('-w', '--workers', type=int, default=8, help='concurrent downloads')
+    args = parser.parse_args()
+
+    resources = catalog.ResourceCatalog.load(args.catalog)
+    max_size = args.max_size << 20 if args.max_size else None
+    cache = ResourceCache(args.root, base=args.base, max_size=max_size, workers=args.workers)
+    order = resources.preload_order()
+    stats = cache.prefetch((res, *resources.resources[res][:2]) for res in order)
+    print(', '.join(f'{k}={v}' for k, v in sorted(stats.items())))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+import struct
+import sys
+
+from alternativa import loader
+
+CATALOG_MAGIC = b'TRC'
+
+class ResourceCatalog():
+    def __init__(self):
+        self.resources = dict()
+        self.dependencies = dict()
+
+    def __len__(self):
+        return len(self.resources)
+
+    def __contains__(self, resource_id):
+        return resource_id in self.resources
+
+    def add(self, resource_id, version, resource_type, lazy=False, dependencies=()):
+        known = self.resources.get(resource_id)
+        # resources are versioned by timestamp, keep the newest one seen in any session
+        if known and known[0] > version:
+            return False
+        self.resources[resource_id] = (version, resource_type, lazy)
+        self.dependencies[resource_id] = tuple(dependencies)
+        return known is None or known[0] != version
+
+    def add_dependencies(self, data):
+        added = 0
+        for res in data['resources']:
+            added += self.add(res['id'], res['version'], res['type'], res['lazy'], res['dependencies'])
+        return added
+
+    def add_event(self, event):
+        if event.type != 'command':
+            return 0
+        data = event.command.data
+        if isinstance(data, dict) and data.get('codec') == 'ObjectsDependenciesCodec':
+            return self.add_dependencies(data)
+        return 0
+
+    def update(self, other):
+        for resource_id, (version, resource_type, lazy) in other.resources.items():
+            self.add(resource_id, version, resource_type, lazy, other.dependencies[resource_id])
+
+    def preload_order(self, resource_ids=None, lazy=True):
+        # iterative post-order DFS, so every resource comes after its dependencies
+        roots = self.resources if resource_ids is None else resource_ids
+        order, visited = list(), set()
+        for root in roots:
+            if root in visited:
+                continue
+            visited.add(root)
+            stack = [(root, iter(self.dependencies.get(root, ())))]
+            while stack:
+                resource_id, deps = stack[-1]
+                for dep in deps:
+                    if dep not in visited:
+                        visited.add(dep)
+                        stack.append((dep, iter(self.dependencies.get(dep, ()))))
+                        break
+                else:
+                    stack.pop()
+                    info = self.resources.get(resource_id)
+                    if info and (lazy or not info[2]):
+                        order.append(resource_id)
+        return order
+
+    def urls(self, resource_ids=None, lazy=True, base=loader.RESOURCE_BASE):
+        urls = list()
+        for resource_id in self.preload_order(resource_ids, lazy=lazy):
+            version, resource_type, _ = self.resources[resource_id]
+            path = loader.get_resource_path(resource_id, version)
+            for fname in loader.FILES_BY_TYPE.get(resource_type, ()):
+                urls.append(''.join((base, path, fname)))
+        return urls
+
+    def save(self, fname):
+        with open(fname, 'wb') as f:
+            f.write(CATALOG_MAGIC)
+            f.write(struct.pack('>I', len(self.resources)))
+            for resource_id, (version, resource_type, lazy) in self.resources.items():
+                deps = self.dependencies[resource_id]
+                f.write(struct.pack('>qhqBH', resource_id, resource_type, version, lazy, len(deps)))
+                f.write(struct.pack(f'>{len(deps)}q', *deps))
+
+    @classmethod
+    def load(cls, fname):
+        catalog = cls()
+        with open(fname, 'rb') as f:
+            data = f.read()
+        if data[:3] != CATALOG_MAGIC:
+            raise ValueError('Invalid magic')
+        count, = struct.unpack_from('>I', data, 3)
+        offset = 7
+        for _ in range(count):
+            resource_id, resource_type, version, lazy, deps = struct.unpack_from('>qhqBH', data, offset)
+            offset += 21
+            dependencies = struct.unpack_from(f'>{deps}q', data, offset)
+            offset += deps * 8
+            catalog.add(resource_id, version, resource_type, bool(lazy), dependencies)
+        return catalog
+
+if __name__ == '__main__':
+    catalog = ResourceCatalog.load(sys.argv[1])
+    for url in catalog.urls():
+        print(url)
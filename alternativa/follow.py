@@ -0,0 +1,67 @@
+import select
+import ctypes
+import time
+import os
+
+IN_MODIFY = 0x00000002
+POLL_INTERVAL = 0.02
+WATCH_TIMEOUT = 1.0
+
+class Inotify():
+    def __init__(self, path):
+        libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        if libc.inotify_add_watch(self.fd, os.fsencode(path), IN_MODIFY) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, 'inotify_add_watch failed')
+
+    def wait(self, timeout):
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return
+        try:
+            while os.read(self.fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def close(self):
+        os.close(self.fd)
+
+def open_watch(path):
+    try:
+        return Inotify(path)
+    except (OSError, AttributeError):
+        # no inotify on this platform, FollowFile falls back to polling
+        return None
+
+class FollowFile():
+    def __init__(self, f, interval=POLL_INTERVAL):
+        self.f = f
+        self.interval = interval
+        self.watch = open_watch(f.name)
+
+    def read(self, length):
+        # a short read means the writer is not done yet, wait for the rest
+        data = self.f.read(length)
+        while len(data) < length:
+            self.wait()
+            data += self.f.read(length - len(data))
+        return data
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self.f.seek(offset, whence)
+
+    def wait(self):
+        if self.watch:
+            self.watch.wait(WATCH_TIMEOUT)
+        else:
+            time.sleep(self.interval)
+
+    def close(self):
+        if self.watch:
+            self.watch.close()
+            self.watch = None
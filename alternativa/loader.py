@@ -26,11 +26,11 @@ def get_resource_path(resourceId, version):
     )
     return '/%o/%o/%o/%o/%o/' % parts
 
-def get_resource_urls(resourceId, version, resourceType):
+def get_resource_urls(resourceId, version, resourceType, base=RESOURCE_BASE):
     path = get_resource_path(resourceId, version)
     urls = list()
     for fname in FILES_BY_TYPE[resourceType]:
-        urls.append(''.join((RESOURCE_BASE, path, fname)))
+        urls.append(''.join((base, path, fname)))
     return urls
 
 def parse_resource_url(url):
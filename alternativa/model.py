@@ -1,15 +1,93 @@
-from collections import defaultdict
+from collections import defaultdict, namedtuple
+import struct
+
 from alternativa import protocol
 
+def record_type(name, fields):
+    # compact codec output, serialized as a dict through _asdict()
+    cls = namedtuple(name, fields, rename=True)
+    cls.names = tuple(fields)
+    cls._asdict = lambda self: to_dict(self, recursive=False)
+    return cls
+
+def to_dict(data, recursive=True):
+    if isinstance(data, tuple) and hasattr(data, 'names'):
+        values = map(to_dict, data) if recursive else data
+        result = {'codec': type(data).__name__}
+        result.update(zip(data.names, values))
+        return result
+    if not recursive:
+        return data
+    if isinstance(data, list):
+        return [to_dict(value) for value in data]
+    if isinstance(data, dict):
+        return {key: to_dict(value) for key, value in data.items()}
+    return data
+
+class FrozenDict(dict):
+    # cached decode results are shared between consumers and must not change under them
+    def _readonly(self, *args, **kwargs):
+        raise TypeError('Cached command data is read-only')
+
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __reduce__(self):
+        return type(self), (dict(self),)
+
+class FrozenList(list):
+    def _readonly(self, *args, **kwargs):
+        raise TypeError('Cached command data is read-only')
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _readonly
+    append = extend = insert = pop = remove = clear = sort = reverse = _readonly
+
+    def __reduce__(self):
+        return type(self), (list(self),)
+
+def freeze(data):
+    # decoded data only holds dicts, lists, tuples and immutable scalars
+    if isinstance(data, dict):
+        return FrozenDict((key, freeze(value)) for key, value in data.items())
+    if isinstance(data, list):
+        return FrozenList(map(freeze, data))
+    if isinstance(data, tuple):
+        values = map(freeze, data)
+        return data._make(values) if hasattr(data, 'names') else tuple(values)
+    return data
+
+def codec_name(data):
+    if isinstance(data, dict):
+        return data['codec']
+    return type(data).__name__
+
+def replace(data, field, value):
+    if isinstance(data, dict):
+        data[field] = value
+        return data
+    return data._replace(**{data._fields[data.names.index(field)]: value})
+
 class Codec():
+    # codecs without random data of their own are left out of generated traffic
+    generated = True
+
     def read(self, packet, optional):
         return {'codec': type(self).__name__}
 
+    def skip(self, packet, optional):
+        self.read(packet, optional)
+
+    def write(self, packet, optional, data):
+        pass
+
+    def random(self, rng):
+        return {'codec': type(self).__name__}
+
 class GameClass(Codec):
     def read(self, packet):
         data = super().read(packet, None)
         data['class_id'] = packet.readLong()
-        data['models'] = [packet.readLong() for _ in range(packet.readInt())]
+        data['models'] = packet.readArray('q', packet.readInt())
         return data
 
 class GameObject(Codec):
@@ -31,6 +109,8 @@ class ModelData(Codec):
         return data
 
 class ObjectsDependenciesCodec(Codec):
+    generated = False
+
     def __init__(self, reader):
         self.reader = reader
 
@@ -48,11 +128,8 @@ class ObjectsDependenciesCodec(Codec):
     def _read_resources(self, packet, data):
         resources = list()
         for _ in range(packet.readInt()):
-            dependencies = list()
             res = self._read_resource_info(packet)
-            for _ in range(packet.readByte()):
-                dependencies.append(packet.readLong())
-            res['dependencies'] = dependencies
+            res['dependencies'] = packet.readArray('q', packet.readByte())
             resources.append(res)
         data['resources'] = resources
 
@@ -64,7 +141,21 @@ class ObjectsDependenciesCodec(Codec):
             'lazy': bool(packet.readByte())
         }
 
+    def write(self, packet, optional, data):
+        packet.writeInt(data['callback_id'])
+        packet.writeInt(len(data['game_classes']))
+        for game_class in data['game_classes']:
+            packet.writeLong(game_class['class_id'])
+            packet.writeInt(len(game_class['models']))
+            packet.writeBytes(struct.pack(f'>{len(game_class["models"])}q', *game_class['models']))
+        packet.writeInt(len(data['resources']))
+        for res in data['resources']:
+            packet.writeBytes(struct.pack('>qhqBB', res['id'], res['type'], res['version'], res['lazy'], len(res['dependencies'])))
+            packet.writeBytes(struct.pack(f'>{len(res["dependencies"])}q', *res['dependencies']))
+
 class ObjectsDataCodec(Codec):
+    generated = False
+
     def __init__(self, reader):
         self.reader = reader
 
@@ -84,16 +175,32 @@ class ObjectsDataCodec(Codec):
         for _ in range(packet.readInt()):
             model_data = codec.read(packet, optional, self.reader)
             model_id = model_data['model_id']
-            if not model_data['data']:
+            if model_data['data'] is None:
                 raise Exception(f'Unknown model ({model_id}), last codec: {prev}')
             models.append(model_data)
             prev = model_id
         data['models'] = models
 
+    def write(self, packet, optional, data):
+        packet.writeInt(len(data['objects']))
+        for obj in data['objects']:
+            packet.writeLong(obj['object_id'])
+            packet.writeLong(obj['class_id'])
+        packet.writeInt(len(data['models']))
+        for model_data in data['models']:
+            model_id = model_data['model_id']
+            packet.writeLong(model_id)
+            if model_id == 0:
+                packet.writeLong(model_data['data'])
+            else:
+                self.reader.codecs[model_id].write(packet, optional, model_data['data'])
+
 class ModelReader():
-    def __init__(self):
-        from alternativa import codecs
-        self.codecs = codecs.CODECS
+    def __init__(self, codecs=None):
+        if codecs is None:
+            from alternativa import codecs as default
+            codecs = default.CODECS
+        self.codecs = codecs
         self.codecs[3216143066888387731] = ObjectsDependenciesCodec(self)
         self.codecs[7640916300855664666] = ObjectsDataCodec(self)
 
@@ -102,5 +209,11 @@ class ModelReader():
             return self.codecs[model_id].read(packet, optional)
         return None
 
+    def skip(self, packet, optional, model_id):
+        if model_id in self.codecs:
+            self.codecs[model_id].skip(packet, optional)
+            return True
+        return False
+
     def get_codec_name(self, model_id):
         return type(self.codecs[model_id]).__name__ if model_id in self.codecs else None
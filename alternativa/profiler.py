@@ -0,0 +1,100 @@
+import time
+import sys
+
+class CodecStats():
+    __slots__ = ('name', 'calls', 'bytes', 'total', 'max', 'blocks')
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.bytes = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.blocks = 0
+
+    def add(self, length, elapsed, blocks):
+        self.calls += 1
+        self.bytes += length
+        self.total += elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+        self.blocks += blocks
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'calls': self.calls,
+            'bytes': self.bytes,
+            'total': self.total,
+            'max': self.max,
+            'blocks': self.blocks
+        }
+
+class Profiler():
+    def __init__(self):
+        self.models = dict()
+        self.commands = CodecStats('SpaceCommandDecoder')
+        # time, bytes and blocks of the models read inside the model being read
+        self.nested = list()
+
+    def instrument(self, decoder):
+        # wraps the bound methods of one decoder, uninstrumented decoders pay nothing
+        reader = decoder.reader
+        read, decode = reader.read, decoder.decode
+
+        def profiled_read(packet, optional, model_id):
+            position, blocks = packet.position, sys.getallocatedblocks()
+            self.nested.append([0.0, 0, 0])
+            start = time.perf_counter()
+            try:
+                return read(packet, optional, model_id)
+            finally:
+                elapsed = time.perf_counter() - start
+                length, blocks = packet.position - position, sys.getallocatedblocks() - blocks
+                # models count their own share only, e.g. ObjectsData without the TankStates it contains
+                child_time, child_length, child_blocks = self.nested.pop()
+                if self.nested:
+                    parent = self.nested[-1]
+                    parent[0] += elapsed
+                    parent[1] += length
+                    parent[2] += blocks
+                stats = self.models.get(model_id)
+                if stats is None:
+                    stats = self.models[model_id] = CodecStats(reader.get_codec_name(model_id))
+                stats.add(length - child_length, elapsed - child_time, blocks - child_blocks)
+
+        def profiled_decode(data, optional):
+            position, blocks = data.position, sys.getallocatedblocks()
+            start = time.perf_counter()
+            try:
+                return decode(data, optional)
+            finally:
+                elapsed = time.perf_counter() - start
+                self.commands.add(data.position - position, elapsed, sys.getallocatedblocks() - blocks)
+
+        # a reader kept loaded by the registry outlives its decoders and comes back with the next connection
+        profiled_read.profiler = profiled_decode.profiler = self
+        if getattr(read, 'profiler', None) is not self:
+            reader.read = profiled_read
+        if getattr(decode, 'profiler', None) is not self:
+            decoder.decode = profiled_decode
+
+    def top(self, n=None, key='total'):
+        ranked = sorted(self.models.items(), key=lambda x: getattr(x[1], key), reverse=True)
+        return ranked[:n] if n else ranked
+
+    def to_dict(self):
+        return {
+            'commands': self.commands.to_dict(),
+            'models': {str(model_id): stats.to_dict() for model_id, stats in self.top()}
+        }
+
+    def report(self, n=20):
+        total = self.commands.total or 1
+        lines = [f'{"model_id":>20} {"codec":<40} {"calls":>9} {"bytes":>11} {"total ms":>10} {"%":>6} {"max us":>9} {"blocks":>10}']
+        for model_id, stats in self.top(n):
+            lines.append(f'{model_id:>20} {str(stats.name)[:40]:<40} {stats.calls:>9} {stats.bytes:>11} '
+                f'{stats.total * 1000:>10.2f} {stats.total * 100 / total:>6.1f} {stats.max * 1e6:>9.1f} {stats.blocks:>10}')
+        commands = self.commands
+        lines.append(f'{commands.calls} commands, {commands.bytes} bytes, {commands.total * 1000:.2f} ms decoding')
+        return '\n'.join(lines)
@@ -1,3 +1,5 @@
+import collections
+import hashlib
 import sys
 import zlib
 import struct
@@ -16,6 +18,11 @@ INPLACE_MASK_FLAG = 0x80
 MASK_LENGTH_1_BYTE = 0x80
 MASK_LENGTH_3_BYTE = 0xC00000
 
+# optional bits a broken command may have used, tried when resynchronizing
+RESYNC_BITS = 8
+# commands after a resynchronization point that have to skip cleanly to confirm it
+RESYNC_COMMANDS = 3
+
 def decode_null_map(data):
     flag = data.readByte()
 
@@ -55,6 +62,26 @@ def decode_null_map(data):
 
     return OptionalMap(size, map)
 
+def encode_null_map(bits):
+    value = 0
+    for bit in bits:
+        value = (value << 1) | bool(bit)
+
+    count = len(bits)
+    if count <= 29:
+        length = (count + 2) // 8
+        size = 5 + length * 8
+        value <<= size - count
+        return (value | (length << size)).to_bytes(length + 1, 'big')
+
+    length = (count + 7) // 8
+    value <<= length * 8 - count
+    if length <= 0x3F:
+        header = bytes((INPLACE_MASK_FLAG | length,))
+    else:
+        header = bytes((INPLACE_MASK_FLAG | INPLACE_MASK_2_BYTES | (length >> 16), (length >> 8) & 0xFF, length & 0xFF))
+    return header + value.to_bytes(length, 'big')
+
 # alternativa.protocol.impl.PacketHelper (unwrapPacket)
 def unwrap_packet(data):
     if data.bytesAvailable() < 2:
@@ -82,11 +109,30 @@ def unwrap_packet(data):
     assert unwrapped.bytesAvailable() == length
     if compressed:
         compressed = unwrapped.readBytes()
-        print('Compressed:', compressed.hex())
         unzipped = zlib.decompress(compressed, -15)
         unwrapped = util.ByteArray(unzipped)
     return unwrapped
 
+# alternativa.protocol.impl.PacketHelper (wrapPacket)
+def wrap_packet(data, compress=False):
+    if compress:
+        compressor = zlib.compressobj(wbits=-15)
+        data = compressor.compress(data) + compressor.flush()
+    length = len(data)
+    if length <= 0x3FFF:
+        flag = (length >> 8) | (ZIPPED_FLAG if compress else 0)
+        return bytes((flag, length & 0xFF)) + data
+    if compress:
+        raise ValueError('Compressed packets must be shorter than 16 KB')
+    return struct.pack('>I', length | (BIG_LENGTH_FLAG << 24)) + data
+
+def encode_length(length):
+    if length < 0x80:
+        return bytes((length,))
+    if length < 0x4000:
+        return bytes((0x80 | (length >> 8), length & 0xFF))
+    return bytes((0xC0 | (length >> 16), (length >> 8) & 0xFF, length & 0xFF))
+
 def decode_length(data):
     byte0 = data.readByte()
     if byte0 & 0x80 == 0:
@@ -98,6 +144,8 @@ def decode_length(data):
     return ((byte0 & 0x3F) << 16) + ((byte1 & 0xFF) << 8) + (byte2 & 0xFF)
 
 class OptionalMap(object):
+    __slots__ = ('size', 'map', 'position')
+
     def __init__(self, size, map):
         self.size = size
         self.map = map
@@ -126,16 +174,25 @@ class OptionalMap(object):
         return f'OptionalMap[pos={tmp},bits={bits},size={self.size}]'
 
 class Command(object):
+    __slots__ = ('command_type', 'data')
+
     def __init__(self, command_type):
         self.command_type = command_type
         self.data = None
 
+    def to_dict(self):
+        return util.slots_dict(self)
+
 class ControlCommand(Command):
+    __slots__ = ('command_id',)
+
     def __init__(self, command_id):
         super().__init__('control')
         self.command_id = command_id
 
 class SpaceCommand(Command):
+    __slots__ = ('object_id', 'method_id')
+
     def __init__(self, object_id, method_id):
         super().__init__('space')
         self.object_id = object_id
@@ -194,19 +251,132 @@ class ServerControlCommandDecoder(Decoder):
             command.data = {'space_id': space_id}
         return command
 
+class UnknownModelError(Exception):
+    def __init__(self, method_id):
+        super().__init__(f'Unknown model ({method_id})')
+        self.method_id = method_id
+
 class SpaceCommandDecoder(Decoder):
-    def __init__(self):
-        self.reader = model.ModelReader()
+    def __init__(self, models=None, objects=None, reader=None, sampler=None):
+        self.reader = reader or model.ModelReader()
+        self.models = models
+        self.objects = objects
+        self.sampler = sampler
+
+    def wanted(self, object_id, method_id):
+        if self.models is not None and method_id not in self.models:
+            return False
+        if self.objects is not None and object_id not in self.objects:
+            return False
+        return self.sampler is None or self.sampler.keep(object_id, method_id)
 
     def decode(self, data, optional):
         object_id, method_id = struct.unpack('>QQ', data.readBytes(16))
+        if not self.wanted(object_id, method_id):
+            if not self.reader.skip(data, optional, method_id):
+                raise UnknownModelError(method_id)
+            return None
+
         command = SpaceCommand(object_id, method_id)
         command.data = self.reader.read(data, optional, method_id)
-        if not command.data:
-            raise Exception(f'Unknown model ({method_id})')
+        if command.data is None:
+            raise UnknownModelError(method_id)
+        if self.sampler and not self.sampler.changed(object_id, method_id, command.data):
+            return None
 
         return command
 
+    def skip(self, data, optional):
+        object_id, method_id = struct.unpack('>QQ', data.readBytes(16))
+        if not self.reader.skip(data, optional, method_id):
+            raise UnknownModelError(method_id)
+        return object_id, method_id
+
+    def resync(self, data, optional, start, bit, max_bits=RESYNC_BITS, max_commands=RESYNC_COMMANDS):
+        # the length of a command that failed is unknown, continue at the next known command that
+        # the commands after it confirm, a later broken command is quarantined and resynchronized on its own
+        buf, end = data.data, len(data.data)
+        codecs = self.reader.codecs
+        def known(offset):
+            return offset + 16 <= end and int.from_bytes(buf[offset + 8:offset + 16], 'big') in codecs
+
+        def padding(bit):
+            # the null map is padded with zeros to a whole byte
+            return 0 <= optional.size - bit < 8 and not any(optional.get_bit(i) for i in range(bit, optional.size))
+
+        def clean_commands(offset, bit):
+            # commands that skip cleanly from offset and whether they reach the end of the packet
+            data.position, optional.position = offset, bit
+            count = 0
+            while True:
+                try:
+                    self.skip(data, optional)
+                except Exception:
+                    return count, False
+                count += 1
+                if data.position == end:
+                    return count, padding(optional.position)
+                if not known(data.position):
+                    return count, False
+
+        for offset in range(start + 16, end - 15):
+            if not known(offset):
+                continue
+            # a known method id inside broken data is often a coincidence, it is confirmed when the rest
+            # of the packet skips cleanly, or max_commands commands do if a later command is broken too,
+            # the optional bits the broken command used are guessed and must not be ambiguous
+            complete, partial = dict(), dict()
+            for used in range(min(max_bits, optional.size - bit) + 1):
+                count, reached = clean_commands(offset, bit + used)
+                if reached or count >= max_commands:
+                    # guesses that read the same optional bits decode the same commands
+                    read = tuple(optional.get_bit(i) for i in range(bit + used, optional.position))
+                    (complete if reached else partial).setdefault(read, used)
+            guesses = list((complete or partial).values())
+            if len(guesses) == 1:
+                data.position, optional.position = offset, bit + guesses[0]
+                return True
+        data.position = end
+        return False
+
+class DecodeCache(object):
+    def __init__(self, size):
+        self.size = size
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, packet):
+        null_map = bytes(packet.data[:packet.position])
+        digest = hashlib.blake2b(packet.data[packet.position:], digest_size=16).digest()
+        return null_map, digest
+
+    def get(self, key):
+        commands = self.entries.get(key)
+        if commands is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return commands
+
+    def put(self, key, commands):
+        # hits hand out the same command objects, their data is frozen by the reader, see model.freeze
+        self.entries[key] = tuple(commands)
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        return {
+            'size': len(self.entries),
+            'capacity': self.size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
+
 class XorProtection(object):
     def __init__(self, hash, id_high, id_low, client):
         self.client = client
@@ -0,0 +1,67 @@
+import collections
+import json
+import time
+import sys
+
+QUARANTINE_SUFFIX = '.quarantine'
+REPORT_INTERVAL = 10.0
+
+class ErrorReport():
+    def __init__(self, interval=REPORT_INTERVAL, out=None):
+        self.interval = interval
+        self.out = out
+        self.totals = collections.Counter()
+        self.pending = collections.Counter()
+        self.messages = dict()
+        self.last = time.monotonic()
+
+    def add(self, key, message, context=''):
+        # the first error of a kind is printed at once, repeats are summed up every interval
+        new = key not in self.totals
+        self.totals[key] += 1
+        if new:
+            self.messages[key] = message
+            print(f'{context}{message}', file=self.out or sys.stderr)
+        else:
+            self.pending[key] += 1
+        now = time.monotonic()
+        if self.pending and now - self.last >= self.interval:
+            self.report(self.pending, f'Repeated errors in the last {now - self.last:.0f}s')
+            self.pending.clear()
+            self.last = now
+        return new
+
+    def report(self, counts, title):
+        lines = [f'  {count} x {self.messages[key]}' for key, count in counts.most_common()]
+        print('\n'.join([f'{title}:'] + lines), file=self.out or sys.stderr)
+
+    def close(self):
+        if self.totals and self.totals != collections.Counter(self.messages.keys()):
+            self.report(self.totals, 'Decode errors')
+
+class Quarantine():
+    def __init__(self, fname=None, interval=REPORT_INTERVAL):
+        self.fname = fname
+        self.f = None
+        self.count = 0
+        self.report = ErrorReport(interval)
+
+    def add(self, key, message, entry, context=''):
+        # opened on the first error, clean dumps leave no sidecar behind
+        self.count += 1
+        if self.fname and self.f is None:
+            self.f = open(self.fname, 'w')
+        if self.f:
+            self.f.write(json.dumps(entry, separators=(',', ':')))
+            self.f.write('\n')
+        return self.report.add(key, message, context)
+
+    def close(self):
+        self.report.close()
+        if self.f:
+            self.f.close()
+            self.f = None
+
+def load(fname):
+    with open(fname, 'r') as f:
+        return [json.loads(line) for line in f]
@@ -0,0 +1,108 @@
+import importlib.util
+import collections
+import argparse
+import hashlib
+import shutil
+import json
+import os
+
+from alternativa import model
+
+INDEX_FILE = 'index.json'
+REGISTRY_DIR = os.path.join('archive', 'registry')
+MAX_MEMORY = 64 << 20
+# loaded codec modules take several times the size of their source
+MEMORY_PER_BYTE = 8
+
+class CodecRegistry():
+    def __init__(self, root=REGISTRY_DIR, max_memory=MAX_MEMORY):
+        self.root = root
+        self.max_memory = max_memory
+        self.versions = dict()
+        self.loaded = collections.OrderedDict()
+        self.memory = 0
+        self.loads = 0
+        self.evictions = 0
+        index = os.path.join(root, INDEX_FILE)
+        if os.path.isfile(index):
+            with open(index, 'r') as f:
+                self.versions = json.load(f)
+
+    def __contains__(self, prot_hash):
+        return prot_hash in self.versions
+
+    def save(self):
+        os.makedirs(self.root, exist_ok=True)
+        index = os.path.join(self.root, INDEX_FILE)
+        with open(index + '.tmp', 'w') as f:
+            json.dump(self.versions, f, indent=4, sort_keys=True)
+        os.replace(index + '.tmp', index)
+
+    def register(self, prot_hash, codecs_file):
+        # versions are stored by content, protocol hashes sharing the same codecs share the file
+        with open(codecs_file, 'rb') as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        fname = f'{digest}.py'
+        os.makedirs(self.root, exist_ok=True)
+        target = os.path.join(self.root, fname)
+        if not os.path.exists(target):
+            shutil.copyfile(codecs_file, target)
+        self.versions[prot_hash] = fname
+        self.save()
+        return fname
+
+    def _load(self, fname):
+        path = os.path.join(self.root, fname)
+        spec = importlib.util.spec_from_file_location(f'alternativa.codecs_{fname[:16]}', path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return model.ModelReader(module.CODECS), os.path.getsize(path) * MEMORY_PER_BYTE
+
+    def reader(self, prot_hash):
+        fname = self.versions.get(prot_hash)
+        if fname is None:
+            return None
+        entry = self.loaded.get(fname)
+        if entry is not None:
+            self.loaded.move_to_end(fname)
+            return entry[0]
+
+        reader, size = self._load(fname)
+        self.loaded[fname] = (reader, size)
+        self.memory += size
+        self.loads += 1
+        # connections still using an evicted version keep it alive until they end
+        while self.memory > self.max_memory and len(self.loaded) > 1:
+            _, (_, evicted) = self.loaded.popitem(last=False)
+            self.memory -= evicted
+            self.evictions += 1
+        return reader
+
+    def stats(self):
+        return {
+            'versions': len(set(self.versions.values())),
+            'loaded': len(self.loaded),
+            'memory': self.memory,
+            'loads': self.loads,
+            'evictions': self.evictions
+        }
+
+def main():
+    parser = argparse.ArgumentParser(description='Manage generated codecs for several protocol versions.')
+    parser.add_argument('-d', '--root', default=REGISTRY_DIR, help='registry directory')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    add_parser = subparsers.add_parser('add', help='register a codecs.py for a protocol hash')
+    add_parser.add_argument('hash', help='protocol hash from CL_SPACE_OPENED')
+    add_parser.add_argument('codecs', help='generated codecs file')
+    subparsers.add_parser('list', help='list registered protocol hashes')
+    args = parser.parse_args()
+
+    registry = CodecRegistry(args.root)
+    if args.command == 'add':
+        print(f'{args.hash} -> {registry.register(args.hash, args.codecs)}')
+    else:
+        for prot_hash, fname in sorted(registry.versions.items()):
+            print(f'{prot_hash} {fname}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+import collections
+import numbers
+
+class Sampler():
+    def __init__(self, models=None):
+        # only these method ids are sampled, everything else is always kept
+        self.models = models
+        self.time = 0
+        self.kept = 0
+        self.dropped = 0
+
+    def keep(self, object_id, method_id):
+        if self.models is not None and method_id not in self.models:
+            return True
+        if self._keep((object_id, method_id)):
+            self.kept += 1
+            return True
+        self.dropped += 1
+        return False
+
+    def changed(self, object_id, method_id, data):
+        return True
+
+    def _keep(self, key):
+        return True
+
+    def stats(self):
+        return {'kept': self.kept, 'dropped': self.dropped}
+
+class EverySampler(Sampler):
+    def __init__(self, n, models=None):
+        super().__init__(models)
+        self.n = n
+        self.counts = collections.Counter()
+
+    def _keep(self, key):
+        count = self.counts[key]
+        self.counts[key] = count + 1
+        return count % self.n == 0
+
+class IntervalSampler(Sampler):
+    def __init__(self, interval, models=None):
+        super().__init__(models)
+        self.interval = interval
+        self.buckets = dict()
+
+    def _keep(self, key):
+        # time is set by the reader to the record time in milliseconds
+        bucket = self.time // self.interval
+        if self.buckets.get(key) == bucket:
+            return False
+        self.buckets[key] = bucket
+        return True
+
+def numbers_of(data):
+    if isinstance(data, bool) or data is None:
+        return
+    if isinstance(data, numbers.Number):
+        yield data
+    elif isinstance(data, dict):
+        for key, value in data.items():
+            if key != 'codec':
+                yield from numbers_of(value)
+    elif isinstance(data, (list, tuple)):
+        for value in data:
+            yield from numbers_of(value)
+
+class ChangeSampler(Sampler):
+    def __init__(self, threshold, models=None):
+        super().__init__(models)
+        self.threshold = threshold
+        self.last = dict()
+
+    def keep(self, object_id, method_id):
+        # a change can only be seen once the command is decoded, see changed
+        return True
+
+    def changed(self, object_id, method_id, data):
+        if self.models is not None and method_id not in self.models:
+            return True
+        key = (object_id, method_id)
+        values = tuple(numbers_of(data))
+        last = self.last.get(key)
+        if last is not None and len(last) == len(values) \
+                and all(abs(a - b) <= self.threshold for a, b in zip(values, last)):
+            self.dropped += 1
+            return False
+        # compared with the last kept value, so slow drifts are still reported
+        self.last[key] = values
+        self.kept += 1
+        return True
+
+def parse_policy(value):
+    # every:N, interval:SECONDS or change:DELTA, returns the sampler class and its argument
+    policy, _, argument = value.partition(':')
+    if policy == 'every' and int(argument) > 0:
+        return EverySampler, int(argument)
+    # record times are in milliseconds, shorter intervals would divide by zero
+    if policy == 'interval' and round(float(argument) * 1000) >= 1:
+        return IntervalSampler, round(float(argument) * 1000)
+    if policy == 'change':
+        return ChangeSampler, float(argument)
+    raise ValueError(f'Unknown sampling policy {value}')
@@ -0,0 +1,227 @@
+import collections
+import datetime
+import bisect
+import struct
+import array
+import math
+import sys
+import os
+
+GRID_MAGIC = b'TSG'
+GRID_SUFFIX = '.grid'
+TANK_STATE = 'TankState'
+SPACE_OPENED = 3
+CELL_SIZE = 500.0
+BATCH_SIZE = 4096
+# objects outside of a known space, e.g. dumps starting after the handshake
+NO_SPACE = 0
+
+def event_millis(event):
+    when = datetime.datetime.fromisoformat(event.time).replace(tzinfo=datetime.timezone.utc)
+    return round(when.timestamp() * 1000)
+
+def little_endian(values):
+    # arrays are stored in a fixed byte order so that grid files can be moved between machines
+    if sys.byteorder == 'big':
+        values = array.array(values.typecode, values)
+        values.byteswap()
+    return values
+
+class SpaceGrid():
+    def __init__(self, cell=CELL_SIZE, dims=2):
+        self.cell = cell
+        self.dims = dims
+        # samples in arrival order, positions are stored flat as x, y, z
+        self.times = array.array('q')
+        self.objects = array.array('q')
+        self.positions = array.array('d')
+        self.speeds = array.array('d')
+        self.counts = collections.Counter()
+        self.speed_sums = collections.Counter()
+        # cell -> (times, sample indexes), both in time order
+        self.cells = dict()
+        self.indexed = 0
+
+    def __len__(self):
+        return len(self.times)
+
+    def add(self, when, object_id, position, speed):
+        self.times.append(when)
+        self.objects.append(object_id)
+        self.positions.extend(position)
+        self.speeds.append(speed)
+
+    def cell_of(self, position):
+        return tuple(math.floor(component / self.cell) for component in position[:self.dims])
+
+    def flush(self):
+        # samples are binned a batch at a time, a per-event update is what made heatmaps slow
+        start, end = self.indexed, len(self.times)
+        if start == end:
+            return
+        positions = self.positions[start * 3:end * 3]
+        scale = 1 / self.cell
+        binned = [map(math.floor, (value * scale for value in positions[axis::3])) for axis in range(self.dims)]
+        keys = list(zip(*binned))
+        speeds = self.speeds[start:end]
+        self.counts.update(keys)
+        for key, speed in zip(keys, speeds):
+            self.speed_sums[key] += speed
+
+        times = self.times
+        for i, key in enumerate(keys, start):
+            entry = self.cells.get(key)
+            if entry is None:
+                entry = self.cells[key] = (array.array('q'), array.array('q'))
+            entry[0].append(times[i])
+            entry[1].append(i)
+        self.indexed = end
+
+    def sort(self):
+        # merged or reordered dumps may deliver samples out of order, queries bisect by time
+        for cell_times, indexes in self.cells.values():
+            if any(cell_times[i] > cell_times[i + 1] for i in range(len(cell_times) - 1)):
+                order = sorted(range(len(cell_times)), key=cell_times.__getitem__)
+                cell_times[:] = array.array('q', (cell_times[i] for i in order))
+                indexes[:] = array.array('q', (indexes[i] for i in order))
+
+    def heatmap(self):
+        return {key: (count, self.speed_sums[key] / count) for key, count in self.counts.items()}
+
+    def near(self, point, radius, since=None, until=None):
+        if len(point) != self.dims:
+            raise ValueError(f'Expected a point with {self.dims} coordinates, got {len(point)}')
+        self.flush()
+        low = self.cell_of([component - radius for component in point])
+        high = self.cell_of([component + radius for component in point])
+        since = -sys.maxsize if since is None else since
+        until = sys.maxsize if until is None else until
+        radius_sq = radius * radius
+        found = dict()
+        ranges = [range(low[axis], high[axis] + 1) for axis in range(self.dims)]
+        for key in _product(ranges):
+            entry = self.cells.get(key)
+            if entry is None:
+                continue
+            cell_times, indexes = entry
+            first = bisect.bisect_left(cell_times, since)
+            last = bisect.bisect_right(cell_times, until)
+            for i in indexes[first:last]:
+                position = self.positions[i * 3:i * 3 + len(point)]
+                if sum((a - b) ** 2 for a, b in zip(position, point)) > radius_sq:
+                    continue
+                when, object_id = self.times[i], self.objects[i]
+                seen = found.get(object_id)
+                found[object_id] = (min(seen[0], when), max(seen[1], when)) if seen else (when, when)
+        return found
+
+def _product(ranges):
+    keys = [()]
+    for values in ranges:
+        keys = [key + (value,) for key in keys for value in values]
+    return keys
+
+class SpatialIndex():
+    def __init__(self, cell=CELL_SIZE, dims=2, batch=BATCH_SIZE):
+        if dims not in (2, 3):
+            raise ValueError('Grids have 2 or 3 dimensions')
+        self.cell = cell
+        self.dims = dims
+        self.batch = batch
+        self.spaces = dict()
+        self.connections = dict()
+        self.pending = 0
+
+    def grid(self, space_id):
+        grid = self.spaces.get(space_id)
+        if grid is None:
+            grid = self.spaces[space_id] = SpaceGrid(self.cell, self.dims)
+        return grid
+
+    def add(self, space_id, when, object_id, position, velocity):
+        self.grid(space_id).add(when, object_id, position, math.hypot(*velocity))
+        self.pending += 1
+        if self.pending >= self.batch:
+            self.flush()
+
+    def flush(self):
+        for grid in self.spaces.values():
+            grid.flush()
+        self.pending = 0
+
+    def feed(self, event):
+        if event.type == 'end':
+            self.connections.pop(event.connection_id, None)
+        if event.type != 'command':
+            return
+
+        command = event.command
+        if command.command_type == 'control':
+            if command.command_id == SPACE_OPENED and command.data:
+                self.connections[event.connection_id] = command.data['space_id']
+            return
+
+        data = command.data
+        if not isinstance(data, dict) or data.get('codec') != TANK_STATE:
+            return
+        space_id = self.connections.get(event.connection_id, NO_SPACE)
+        self.add(space_id, event_millis(event), command.object_id, data['position'], data['linearVelocity'])
+
+    def sort(self):
+        self.flush()
+        for grid in self.spaces.values():
+            grid.sort()
+
+    def consume(self, events):
+        for event in events:
+            self.feed(event)
+            yield event
+        self.sort()
+
+    def near(self, point, radius, since=None, until=None, space_id=None):
+        if len(point) != self.dims:
+            raise ValueError(f'Expected a point with {self.dims} coordinates, got {len(point)}')
+        found = dict()
+        spaces = self.spaces if space_id is None else [space_id]
+        for space in spaces:
+            if space in self.spaces:
+                for object_id, (first, last) in self.spaces[space].near(point, radius, since, until).items():
+                    found[(space, object_id)] = (first, last)
+        return found
+
+    def heatmap(self, space_id):
+        self.flush()
+        return self.spaces[space_id].heatmap()
+
+    def save(self, fname):
+        self.flush()
+        with open(fname + '.tmp', 'wb') as f:
+            f.write(GRID_MAGIC)
+            f.write(struct.pack('<dBI', self.cell, self.dims, len(self.spaces)))
+            for space_id, grid in self.spaces.items():
+                f.write(struct.pack('<qI', space_id, len(grid)))
+                for values in (grid.times, grid.objects, grid.positions, grid.speeds):
+                    f.write(little_endian(values).tobytes())
+        os.replace(fname + '.tmp', fname)
+
+    @classmethod
+    def load(cls, fname, batch=BATCH_SIZE):
+        with open(fname, 'rb') as f:
+            data = f.read()
+        if data[:3] != GRID_MAGIC:
+            raise ValueError('Invalid magic')
+        cell, dims, count = struct.unpack_from('<dBI', data, 3)
+        offset = 3 + struct.calcsize('<dBI')
+        index = cls(cell, dims, batch)
+        for _ in range(count):
+            space_id, samples = struct.unpack_from('<qI', data, offset)
+            offset += struct.calcsize('<qI')
+            grid = index.grid(space_id)
+            for values, size in ((grid.times, samples), (grid.objects, samples), (grid.positions, samples * 3), (grid.speeds, samples)):
+                end = offset + size * values.itemsize
+                values.frombytes(data[offset:end])
+                if sys.byteorder == 'big':
+                    values.byteswap()
+                offset = end
+        index.sort()
+        return index
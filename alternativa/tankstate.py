@@ -16,6 +16,14 @@ def read_vector3(area, bits, factor):
     z = (area.read(bits) - (1 << bits - 1)) * factor
     return x, y, z
 
+def random_vector3(rng, bits, factor):
+    return tuple((rng.randrange(1 << bits) - (1 << bits - 1)) * factor for _ in range(3))
+
+def write_vector3(area, bits, factor, vector):
+    offset, limit = 1 << bits - 1, (1 << bits) - 1
+    for component in vector:
+        area.write(min(max(round(component / factor) + offset, 0), limit), bits)
+
 class BitArea:
     def __init__(self, data, size):
         self.data = data
@@ -38,6 +46,14 @@ class BitArea:
             bits -= 1
         return value
 
+    def write(self, value, bits):
+        bits = bits - 1
+        while bits >= 0:
+            if value & (1 << bits):
+                self.data[self.position >> 3] |= 1 << ((7 ^ self.position) & 7)
+            self.position += 1
+            bits -= 1
+
 class TankState(Codec):
     def read(self, packet, optional):
         data = super().read(packet, optional)
@@ -51,3 +67,22 @@ class TankState(Codec):
         data['orientation'] = orientation
         data['position'] = position
         return data
+
+    def skip(self, packet, optional):
+        packet.skip(BIT_AREA_SIZE)
+
+    def write(self, packet, optional, data):
+        area = BitArea(bytearray(BIT_AREA_SIZE), BIT_AREA_SIZE)
+        write_vector3(area, POSITION_COMPONENT_BITSIZE, 1, data['position'])
+        write_vector3(area, ORIENTATION_COMPONENT_BITSIZE, ANGLE_FACTOR, data['orientation'])
+        write_vector3(area, LINEAR_VELOCITY_COMPONENT_BITSIZE, 1, data['linearVelocity'])
+        write_vector3(area, ANGULAR_VELOCITY_COMPONENT_BITSIZE, ANGULAR_VELOCITY_FACTOR, data['angularVelocity'])
+        packet.writeBytes(area.data)
+
+    def random(self, rng):
+        data = super().random(rng)
+        data['angularVelocity'] = random_vector3(rng, ANGULAR_VELOCITY_COMPONENT_BITSIZE, ANGULAR_VELOCITY_FACTOR)
+        data['linearVelocity'] = random_vector3(rng, LINEAR_VELOCITY_COMPONENT_BITSIZE, 1)
+        data['orientation'] = random_vector3(rng, ORIENTATION_COMPONENT_BITSIZE, ANGLE_FACTOR)
+        data['position'] = random_vector3(rng, POSITION_COMPONENT_BITSIZE, 1)
+        return data
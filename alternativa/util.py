@@ -1,7 +1,28 @@
+import functools
+import string
 import struct
 
 from alternativa import protocol
 
+ITEM_SIZES = {'b': 1, 'B': 1, '?': 1, 'h': 2, 'i': 4, 'q': 8, 'f': 4, 'd': 8}
+
+def random_float(rng):
+    # only values representable as single precision survive a round trip
+    return struct.unpack('>f', struct.pack('>f', rng.uniform(-1e6, 1e6)))[0]
+
+def random_string(rng, max_length=16):
+    return ''.join(rng.choices(string.ascii_letters + string.digits, k=rng.randrange(max_length)))
+
+@functools.lru_cache(maxsize=None)
+def slot_names(cls):
+    names = list()
+    for klass in reversed(cls.__mro__):
+        names.extend(klass.__dict__.get('__slots__', ()))
+    return tuple(names)
+
+def slots_dict(obj):
+    return {name: getattr(obj, name) for name in slot_names(type(obj))}
+
 class ByteArray(object):
     def __init__(self, data=None):
         self.data = data if data else bytearray()
@@ -11,6 +32,34 @@ class ByteArray(object):
         self.data += struct.pack('>B', byte & 0xFF)
         self.position += 1
 
+    def writeBytes(self, data):
+        self.data += data
+        self.position += len(data)
+
+    def writeShort(self, value):
+        self.writeBytes(struct.pack('>h', value))
+
+    def writeInt(self, value):
+        self.writeBytes(struct.pack('>i', value))
+
+    def writeLong(self, value):
+        self.writeBytes(struct.pack('>q', value))
+
+    def writeFloat(self, value):
+        self.writeBytes(struct.pack('>f', value))
+
+    def writeDouble(self, value):
+        self.writeBytes(struct.pack('>d', value))
+
+    def writeVector(self, fmt, values):
+        self.writeBytes(protocol.encode_length(len(values)))
+        self.writeBytes(struct.pack(f'>{len(values)}{fmt}', *values))
+
+    def writeString(self, string):
+        data = string.encode('utf-8')
+        self.writeBytes(protocol.encode_length(len(data)))
+        self.writeBytes(data)
+
     def readByte(self):
         if not self.bytesAvailable():
             raise IndexError('Tried to read more bytes than available')
@@ -27,6 +76,11 @@ class ByteArray(object):
         self.position += len(bytes)
         return bytes
 
+    def skip(self, length):
+        if length > self.bytesAvailable():
+            raise IndexError('Tried to skip more bytes than available')
+        self.position += length
+
     def readShort(self):
         return struct.unpack('>h', self.readBytes(2))[0]
 
@@ -46,17 +100,25 @@ class ByteArray(object):
         length = protocol.decode_length(self)
         return self.readBytes(length).decode('utf-8')
 
+    def skipString(self):
+        self.skip(protocol.decode_length(self))
+
+    def readArray(self, fmt, count):
+        length = ITEM_SIZES[fmt] * count
+        if length > self.bytesAvailable():
+            raise IndexError('Tried to read more bytes than available')
+        values = struct.unpack_from(f'>{count}{fmt}', self.data, self.position)
+        self.position += length
+        return list(values)
+
+    def readVector(self, fmt):
+        return self.readArray(fmt, protocol.decode_length(self))
+
     def readIntVector(self):
-        vector = list()
-        for _ in range(protocol.decode_length(self)):
-            vector.append(self.readInt())
-        return vector
+        return self.readVector('i')
 
     def readLongVector(self):
-        vector = list()
-        for _ in range(protocol.decode_length(self)):
-            vector.append(self.readLong())
-        return vector
+        return self.readVector('q')
 
     def bytesAvailable(self):
         return len(self.data) - self.position
@@ -0,0 +1,166 @@
+import collections
+import bisect
+
+OBJECTS_DATA = 'ObjectsDataCodec'
+OBJECTS_DEPENDENCIES = 'ObjectsDependenciesCodec'
+SPACE_OPENED = 3
+
+ObjectState = collections.namedtuple('ObjectState', ('class_id', 'space_id', 'models'))
+
+class WorldView():
+    def __init__(self, classes, objects, model_objects, space_objects, history):
+        self.classes = classes
+        self.objects = objects
+        self.model_objects = model_objects
+        self.space_objects = space_objects
+        self.history = history
+
+    def get(self, object_id):
+        return self.objects.get(object_id)
+
+    def state_at(self, object_id, when):
+        times, states = self.history.get(object_id, ((), ()))
+        i = bisect.bisect_right(times, when)
+        return states[i - 1] if i else None
+
+    def models_of_class(self, class_id):
+        return self.classes.get(class_id, ())
+
+    def objects_in_space(self, space_id):
+        return self.space_objects.get(space_id, frozenset())
+
+    def objects_with_model(self, model_id, space_id=None):
+        objects = self.model_objects.get(model_id, frozenset())
+        if space_id is None:
+            return objects
+        return objects & self.objects_in_space(space_id)
+
+class WorldSnapshot(WorldView):
+    def __init__(self, world, when):
+        super().__init__(world.classes, world.objects, world.model_objects, world.space_objects, world.history)
+        self.time = when
+
+    def state_at(self, object_id, when):
+        return super().state_at(object_id, min(when, self.time))
+
+class WorldState(WorldView):
+    def __init__(self):
+        super().__init__(dict(), dict(), dict(), dict(), dict())
+        self.connections = dict()
+        self.time = ''
+        self.shared = False
+        self.owned = set()
+
+    def snapshot(self):
+        # indexes are shared with the snapshot and copied on the next write
+        self.shared = True
+        return WorldSnapshot(self, self.time)
+
+    def _unshare(self):
+        if not self.shared:
+            return
+        self.classes = dict(self.classes)
+        self.objects = dict(self.objects)
+        self.model_objects = dict(self.model_objects)
+        self.space_objects = dict(self.space_objects)
+        self.history = dict(self.history)
+        self.owned = set()
+        self.shared = False
+
+    def _index_add(self, index, key, object_id):
+        objects = index.get(key)
+        if objects is not None and object_id in objects:
+            return
+        if (id(index), key) not in self.owned:
+            objects = set(objects or ())
+            index[key] = objects
+            self.owned.add((id(index), key))
+        objects.add(object_id)
+
+    def _index_remove(self, index, key, object_id):
+        objects = index.get(key)
+        if objects is None or object_id not in objects:
+            return
+        if (id(index), key) not in self.owned:
+            objects = set(objects)
+            index[key] = objects
+            self.owned.add((id(index), key))
+        objects.discard(object_id)
+        if not objects:
+            del index[key]
+
+    def _set_object(self, object_id, state):
+        self._unshare()
+        previous = self.objects.get(object_id)
+        self.objects[object_id] = state
+        # history lists are copied on write like the indexes, a snapshot must not see later states
+        times, states = self.history.get(object_id, ((), ()))
+        if (id(self.history), object_id) not in self.owned:
+            times, states = list(times), list(states)
+            self.history[object_id] = (times, states)
+            self.owned.add((id(self.history), object_id))
+        times.append(self.time)
+        states.append(state)
+        if previous:
+            for model_id in previous.models:
+                if model_id not in state.models:
+                    self._index_remove(self.model_objects, model_id, object_id)
+            if previous.space_id is not None and previous.space_id != state.space_id:
+                self._index_remove(self.space_objects, previous.space_id, object_id)
+        for model_id in state.models:
+            self._index_add(self.model_objects, model_id, object_id)
+        if state.space_id is not None:
+            self._index_add(self.space_objects, state.space_id, object_id)
+
+    def feed(self, event):
+        self.time = event.time
+        if event.type != 'command':
+            return
+
+        command = event.command
+        if command.command_type == 'control':
+            if command.command_id == SPACE_OPENED and command.data:
+                self.connections[event.connection_id] = command.data['space_id']
+            return
+
+        data = command.data
+        codec = data.get('codec') if isinstance(data, dict) else None
+        if codec == OBJECTS_DEPENDENCIES:
+            self._unshare()
+            for game_class in data['game_classes']:
+                self.classes[game_class['class_id']] = tuple(game_class['models'])
+        elif codec == OBJECTS_DATA:
+            self._load_objects(data, self.connections.get(event.connection_id))
+
+    def _load_objects(self, data, space_id):
+        loaded = dict()
+        for obj in data['objects']:
+            object_id, class_id = obj['object_id'], obj['class_id']
+            known = self.objects.get(object_id)
+            object_models = dict(known.models) if known and known.class_id == class_id else dict()
+            for model_id in self.classes.get(class_id, ()):
+                object_models.setdefault(model_id, None)
+            loaded[object_id] = (class_id, object_models)
+
+        # model data is grouped by object, each group starts with a marker whose model id is 0
+        # and whose data is the object id, the entries that follow belong to that object
+        current = None
+        for entry in data['models']:
+            model_id = entry['model_id']
+            if model_id == 0:
+                current = entry['data']
+                known = self.objects.get(current)
+                if current not in loaded and known:
+                    loaded[current] = (known.class_id, dict(known.models))
+            elif current in loaded:
+                loaded[current][1][model_id] = entry['data']
+
+        for object_id, (class_id, object_models) in loaded.items():
+            known = self.objects.get(object_id)
+            object_space = known.space_id if known and space_id is None else space_id
+            self._set_object(object_id, ObjectState(class_id, object_space, object_models))
+
+    def consume(self, events):
+        for event in events:
+            self.feed(event)
+            yield event
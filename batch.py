@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+import multiprocessing
+import collections
+import contextlib
+import argparse
+import fnmatch
+import glob
+import time
+import json
+import os
+
+import simplejson
+
+import altdump
+from alternativa import model, registry
+from alternativa.quarantine import Quarantine, QUARANTINE_SUFFIX
+
+MANIFEST_FILE = 'manifest.json'
+SUMMARY_FILE = 'summary.json'
+
+def find_dumps(inputs, pattern='*.tnk'):
+    files = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, _, names in os.walk(item):
+                files.update(os.path.join(root, name) for name in fnmatch.filter(names, pattern))
+        else:
+            files.update(path for path in glob.glob(item, recursive=True) if os.path.isfile(path))
+    return sorted(os.path.abspath(path) for path in files)
+
+class Manifest():
+    def __init__(self, path):
+        self.path = path
+        self.files = dict()
+        if os.path.isfile(path):
+            with open(path, 'r') as f:
+                self.files = json.load(f)['files']
+
+    def is_done(self, fname, stat):
+        entry = self.files.get(fname)
+        return entry is not None and entry['status'] == 'done' \
+            and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime
+
+    def update(self, fname, entry):
+        self.files[fname] = entry
+        self.save()
+
+    def save(self):
+        # an interrupted run must never leave a truncated manifest behind
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'files': self.files}, f, indent=4)
+        os.replace(tmp, self.path)
+
+    def summary(self):
+        totals = collections.Counter()
+        methods = collections.Counter()
+        failed = dict()
+        for fname, entry in self.files.items():
+            totals[entry['status']] += 1
+            if entry['status'] == 'failed':
+                failed[fname] = entry['error']
+                continue
+            for key in ('size', 'events', 'commands', 'errors', 'seconds'):
+                totals[key] += entry[key]
+            methods.update({int(method_id): count for method_id, count in entry['methods'].items()})
+        return {
+            'totals': dict(totals),
+            'methods': {str(method_id): count for method_id, count in methods.most_common()},
+            'failed': failed
+        }
+
+REGISTRY = None
+
+def init_worker(registry_root=None):
+    # importing the generated codecs is the slow part of startup, do it once per worker
+    global REGISTRY
+    model.ModelReader()
+    if registry_root:
+        REGISTRY = registry.CodecRegistry(registry_root)
+
+def process(task):
+    fname, output, cache_size = task
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    start = time.perf_counter()
+    entry = {'events': 0, 'commands': 0, 'errors': 0}
+    methods = collections.Counter()
+    tmp, log = output + '.tmp', output + '.log'
+    errors = Quarantine(output + QUARANTINE_SUFFIX)
+    if os.path.exists(errors.fname):
+        os.remove(errors.fname)
+    try:
+        with open(fname, 'rb') as f, open(tmp, 'w') as out, open(log, 'w') as err, contextlib.redirect_stderr(err):
+            out.write('[')
+            for event in altdump.ProtocolEventReader(f, cache_size=cache_size, registry=REGISTRY, quarantine=errors):
+                out.write(',\n' if entry['events'] else '\n')
+                out.write(simplejson.dumps(event.to_dict(), ignore_nan=True))
+                entry['events'] += 1
+                if event.type == 'command' and event.command.command_type == 'space':
+                    entry['commands'] += 1
+                    if event.command.method_id is None:
+                        entry['errors'] += 1
+                    else:
+                        methods[event.command.method_id] += 1
+            out.write('\n]\n')
+            errors.close()
+        os.replace(tmp, output)
+        entry.update(status='done', methods={str(k): v for k, v in methods.items()})
+    except Exception as e:
+        errors.close()
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        entry = {'status': 'failed', 'error': f'{type(e).__name__}: {e}'}
+    if os.path.exists(log) and not os.path.getsize(log):
+        os.remove(log)
+    entry['seconds'] = time.perf_counter() - start
+    return fname, entry
+
+def run(files, directory, manifest, workers=None, cache_size=0, retry_failed=True, registry_root=None):
+    root = os.path.commonpath([os.path.dirname(fname) for fname in files]) if files else ''
+    tasks = list()
+    for fname in files:
+        stat = os.stat(fname)
+        entry = manifest.files.get(fname)
+        if manifest.is_done(fname, stat) or (entry and entry['status'] == 'failed' and not retry_failed):
+            continue
+        output = os.path.join(directory, os.path.relpath(fname, root) + '.json')
+        tasks.append((stat.st_size, fname, output))
+    # the largest dumps go first so that no worker is left with a big file at the end
+    tasks.sort(reverse=True)
+    print(f'{len(tasks)} of {len(files)} dumps to process')
+
+    with multiprocessing.Pool(workers, initializer=init_worker, initargs=(registry_root,)) as pool:
+        sizes = {fname: size for size, fname, _ in tasks}
+        results = pool.imap_unordered(process, [(fname, output, cache_size) for _, fname, output in tasks])
+        for i, (fname, entry) in enumerate(results, 1):
+            stat = os.stat(fname)
+            entry.update(size=sizes[fname], mtime=stat.st_mtime)
+            manifest.update(fname, entry)
+            status = entry['status'] if entry['status'] == 'done' else entry['error']
+            print(f'[{i}/{len(tasks)}] {fname}: {status} ({entry["seconds"]:.2f}s)', flush=True)
+
+def main():
+    parser = argparse.ArgumentParser(description='Decode many packet dumps with a pool of worker processes.')
+    parser.add_argument('inputs', nargs='+', help='dump files, directories or glob patterns')
+    parser.add_argument('-o', '--output', required=True, help='directory for the decoded dumps and the manifest')
+    parser.add_argument('-p', '--pattern', default='*.tnk', help='file pattern used in directories')
+    parser.add_argument('-w', '--workers', type=int, help='number of worker processes, one per cpu by default')
+    parser.add_argument('--cache', type=int, default=0, metavar='N', help='cache decoded commands of the last N distinct packets')
+    parser.add_argument('--skip-failed', action='store_true', help='do not retry dumps that failed in a previous run')
+    parser.add_argument('--registry', metavar='DIR', help='pick codecs by protocol hash from a codec registry')
+    args = parser.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+    manifest = Manifest(os.path.join(args.output, MANIFEST_FILE))
+    files = find_dumps(args.inputs, args.pattern)
+    try:
+        run(files, args.output, manifest, args.workers, args.cache, not args.skip_failed, args.registry)
+    except KeyboardInterrupt:
+        print('Interrupted, run again to resume')
+
+    summary = manifest.summary()
+    with open(os.path.join(args.output, SUMMARY_FILE), 'w') as f:
+        json.dump(summary, f, indent=4)
+    totals = summary['totals']
+    print(f'{totals.get("done", 0)} done, {totals.get("failed", 0)} failed, {totals.get("events", 0)} events, '
+        f'{totals.get("errors", 0)} undecoded commands')
+
+if __name__ == '__main__':
+    main()
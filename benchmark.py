@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+import statistics
+import platform
+import argparse
+import datetime
+import tempfile
+import random
+import struct
+import types
+import time
+import sys
+import io
+import os
+
+import simplejson
+
+import altdump
+import codecgen
+import traffic
+from alternativa import protocol, tankstate, model, util
+
+BASE_TIME = 1600000000.0
+OBJECTS_DATA_ID = 7640916300855664666
+TANK_STATE_ID = 0x54414E4B53544154 # not a real model, registered for the benchmark only
+DEFAULT_MIX = 'objects=0.05,tankstate=0.95'
+# model id: (class, method, weight) for the codec specialization benchmark
+CODEC_MIX = {
+    101: ('TankModel', 'move', 0.45),
+    102: ('TankModel', 'rotateTurret', 0.2),
+    103: ('WeaponModel', 'shot', 0.15),
+    104: ('HealthModel', 'setHealth', 0.1),
+    105: ('ChatModel', 'showMessage', 0.05),
+    106: ('BattleModel', 'addTank', 0.05)
+}
+
+def tank_state(rng, packet):
+    data = {
+        'position': tuple(rng.uniform(-20000, 20000) for _ in range(3)),
+        'orientation': tuple(rng.uniform(-3.14, 3.14) for _ in range(3)),
+        'linearVelocity': tuple(rng.uniform(-1000, 1000) for _ in range(3)),
+        'angularVelocity': tuple(rng.uniform(-10, 10) for _ in range(3))
+    }
+    tankstate.TankState().write(packet, None, data)
+
+def objects_data(rng, packet, count):
+    packet.writeInt(count)
+    for _ in range(count):
+        packet.writeLong(rng.getrandbits(48))
+        packet.writeLong(rng.getrandbits(48))
+    packet.writeInt(count)
+    for _ in range(count):
+        if rng.random() < 0.5:
+            packet.writeLong(0)
+            packet.writeLong(rng.getrandbits(48))
+        else:
+            packet.writeLong(TANK_STATE_ID)
+            tank_state(rng, packet)
+
+def space_packet(rng, kind):
+    packet = util.ByteArray()
+    packet.writeByte(0) # empty null map
+    if kind == 'objects':
+        packet.writeBytes(struct.pack('>QQ', rng.getrandbits(48), OBJECTS_DATA_ID))
+        objects_data(rng, packet, rng.randint(10, 100))
+    else:
+        for _ in range(rng.randint(1, 16)):
+            packet.writeBytes(struct.pack('>QQ', rng.getrandbits(48), TANK_STATE_ID))
+            tank_state(rng, packet)
+    return bytes(packet.data)
+
+def handshake(rng):
+    request = util.ByteArray()
+    request.writeBytes(b'\x00\x01\x01')
+    request.writeString('version')
+    request.writeBytes(b'\x01')
+    request.writeString(str(rng.randint(1, 1 << 20)))
+    response = b'\x00\x02' + rng.randbytes(32) + b'\x00'
+    opened = b'\x00\x03' + rng.randbytes(32) + struct.pack('>Q', rng.getrandbits(48))
+    return bytes(request.data), response, opened
+
+def parse_mix(mix):
+    weights = dict()
+    for item in mix.split(','):
+        kind, weight = item.split('=')
+        weights[kind] = float(weight)
+    return weights
+
+def generate_dump(fname, packets, connections=4, mix=DEFAULT_MIX, seed=0):
+    rng = random.Random(seed)
+    weights = parse_mix(mix)
+    kinds, cum_weights = list(weights), list()
+    for kind in kinds:
+        cum_weights.append((cum_weights[-1] if cum_weights else 0) + weights[kind])
+
+    when = BASE_TIME
+    with altdump.PacketWriter(fname, start=BASE_TIME) as w:
+        for conn_id in range(connections):
+            src, dst = ('127.0.0.1', 50000 + conn_id), ('10.0.0.1', 5190)
+            w.write(altdump.RecordBegin(conn_id, True, src, dst, when=when))
+            request, response, opened = handshake(rng)
+            w.write(altdump.RecordData(conn_id, True, request, when=when))
+            w.write(altdump.RecordData(conn_id, False, response, when=when))
+            w.write(altdump.RecordData(conn_id, True, opened, when=when))
+
+        for _ in range(packets):
+            when += rng.expovariate(1000)
+            kind = rng.choices(kinds, cum_weights=cum_weights)[0]
+            w.write(altdump.RecordData(rng.randrange(connections), rng.random() < 0.1, space_packet(rng, kind), when=when))
+
+        for conn_id in range(connections):
+            w.write(altdump.RecordEnd(conn_id, True, when=when))
+
+def codec_definitions():
+    def field(type_name, optional=False, info_type='TypeCodecInfo'):
+        return codecgen.TypeCodecInfo(info_type, type_name, optional)
+    def vector(element, optional=False):
+        return codecgen.CollectionCodecInfo(element, optional)
+
+    codecs = {
+        'Vector3d': codecgen.CodecDefinition('Vector3d', {'x': field('Float'), 'y': field('Float'), 'z': field('Float')}),
+        'MoveCommand': codecgen.CodecDefinition('MoveCommand', {
+            'position': field('Vector3d'), 'orientation': field('Vector3d'),
+            'linearVelocity': field('Vector3d'), 'angularVelocity': field('Vector3d'), 'control': field('Byte')
+        }),
+        'TargetHit': codecgen.CodecDefinition('TargetHit', {
+            'target': field('IGameObject'), 'position': field('Vector3d'), 'direction': field('Vector3d', True),
+            'incarnation': field('Short')
+        }),
+        'UserStatus': codecgen.CodecDefinition('UserStatus', {
+            'uid': field('String'), 'rank': field('Byte'), 'premium': field('Boolean'), 'clan': field('String', True)
+        })
+    }
+    fields = {
+        101: {'time': field('int'), 'specificationId': field('Short'), 'move': field('MoveCommand')},
+        102: {'time': field('int'), 'angle': field('Float'), 'control': field('Byte', info_type='EnumCodecInfo')},
+        103: {'time': field('int'), 'barrel': field('Byte'), 'hits': vector(field('TargetHit')), 'staticHit': field('Vector3d', True)},
+        104: {'health': field('Float'), 'maxHealth': field('Float'), 'source': field('IGameObject', True)},
+        105: {'sender': field('UserStatus', True), 'text': field('String'), 'team': field('Boolean')},
+        106: {'tank': field('IGameObject'), 'user': field('UserStatus'), 'position': field('Vector3d'), 'modules': vector(field('Long'))}
+    }
+    models = list()
+    for model_id, (class_name, method, _) in CODEC_MIX.items():
+        definition = codecgen.ModelMethod(model_id, class_name, method)
+        definition.fields = fields[model_id]
+        models.append(definition)
+    return codecs, models
+
+def load_codecs(compact, hot_models):
+    # definitions cache their generated code, every variant starts from fresh ones
+    source, _, _ = codecgen.render(*codec_definitions(), compact=compact, hot_models=hot_models)
+    module = types.ModuleType(f'codecs_{"compact" if compact else "dict"}_{len(hot_models)}')
+    exec(compile(source, module.__name__, 'exec'), module.__dict__)
+    return model.ModelReader(module.CODECS)
+
+def codec_traffic(reader, packets, seed):
+    rng = random.Random(seed)
+    model_ids = list(CODEC_MIX)
+    weights = [weight for _, _, weight in CODEC_MIX.values()]
+    payloads = list()
+    for _ in range(packets):
+        packet, optional = util.ByteArray(), list()
+        for model_id in rng.choices(model_ids, weights, k=rng.randint(1, 8)):
+            codec = reader.codecs[model_id]
+            traffic.write_command(packet, optional, codec, rng.getrandbits(48), model_id, codec.random(rng))
+        payloads.append(protocol.encode_null_map(optional) + bytes(packet.data))
+    return payloads
+
+def decode_all(decoder, payloads):
+    commands = list()
+    for data in payloads:
+        packet = util.ByteArray(data)
+        optional = protocol.decode_null_map(packet)
+        while packet.bytesAvailable():
+            commands.append(model.to_dict(decoder.decode(packet, optional).data))
+    return commands
+
+def specialization(packets, top, seed=0, rounds=5):
+    ranked = sorted(CODEC_MIX, key=lambda model_id: CODEC_MIX[model_id][2], reverse=True)
+    hot_models = set(ranked[:top])
+    results = dict()
+    for compact in (False, True):
+        mode = 'compact' if compact else 'dict'
+        payloads = codec_traffic(load_codecs(compact, ()), packets, seed)
+        decoders = {
+            'generic': protocol.SpaceCommandDecoder(reader=load_codecs(compact, ())),
+            'specialized': protocol.SpaceCommandDecoder(reader=load_codecs(compact, hot_models))
+        }
+        if decode_all(decoders['generic'], payloads) != decode_all(decoders['specialized'], payloads):
+            raise AssertionError(f'Specialized {mode} codecs decode differently')
+
+        # variants take turns and keep their best round, a single run is too noisy to compare
+        for _ in range(rounds):
+            for variant, decoder in decoders.items():
+                def decode(data):
+                    packet = util.ByteArray(data)
+                    optional = protocol.decode_null_map(packet)
+                    while packet.bytesAvailable():
+                        decoder.decode(packet, optional)
+                    return len(data)
+                result = measure(payloads, decode)
+                best = results.get(f'{mode}_{variant}')
+                if best is None or result['items_per_s'] > best['items_per_s']:
+                    results[f'{mode}_{variant}'] = result
+    return results
+
+def measure(items, func):
+    latencies = list()
+    nbytes = 0
+    clock = time.perf_counter
+    start = clock()
+    for item in items:
+        t = clock()
+        nbytes += func(item) or 0
+        latencies.append(clock() - t)
+    elapsed = clock() - start
+    latencies.sort()
+    return {
+        'items': len(latencies),
+        'bytes': nbytes,
+        'seconds': elapsed,
+        'items_per_s': len(latencies) / elapsed if elapsed else 0,
+        'mb_per_s': nbytes / elapsed / (1 << 20) if elapsed else 0,
+        'p50_us': statistics.median(latencies) * 1e6 if latencies else 0,
+        'p99_us': latencies[int(len(latencies) * 0.99)] * 1e6 if latencies else 0,
+        'max_us': latencies[-1] * 1e6 if latencies else 0
+    }
+
+def benchmark_reader():
+    # the benchmark model is added to a copy, the default codecs are shared with everything else
+    from alternativa import codecs
+    benchmark_codecs = dict(codecs.CODECS)
+    benchmark_codecs[TANK_STATE_ID] = tankstate.TankState()
+    return model.ModelReader(benchmark_codecs)
+
+def run(fname, compressed=0.2, seed=0, model_reader=None):
+    with open(fname, 'rb') as f:
+        contents = f.read()
+    model_reader = model_reader or benchmark_reader()
+
+    stages = dict()
+    reader = altdump.PacketReader(io.BytesIO(contents))
+    records = list()
+    def read_record(_):
+        record = next(reader)
+        records.append(record)
+        return len(record.data) if record.rec_type == altdump.RECORD_DATA else 0
+    count = sum(1 for _ in altdump.PacketReader(io.BytesIO(contents)))
+    stages['read'] = measure(range(count), read_record)
+
+    # space payloads follow the CL_SPACE_OPENED command of their connection
+    in_space, payloads = set(), list()
+    for record in records:
+        if record.rec_type != altdump.RECORD_DATA:
+            continue
+        if record.conn_id in in_space:
+            payloads.append(record.data)
+        elif record.outgoing and record.data[1] == 3:
+            in_space.add(record.conn_id)
+
+    def null_map(data):
+        packet = util.ByteArray(data)
+        protocol.decode_null_map(packet)
+        return packet.position
+    stages['null_map'] = measure(payloads, null_map)
+
+    rng = random.Random(seed)
+    frames = [protocol.wrap_packet(data, rng.random() < compressed and len(data) < 0x3FFF) for data in payloads]
+    stages['unwrap'] = measure(frames, lambda frame: len(protocol.unwrap_packet(util.ByteArray(bytearray(frame)))))
+
+    decoder = protocol.SpaceCommandDecoder(reader=model_reader)
+    def decode(data):
+        packet = util.ByteArray(data)
+        optional = protocol.decode_null_map(packet)
+        while packet.bytesAvailable():
+            decoder.decode(packet, optional)
+        return len(data)
+    stages['decode'] = measure(payloads, decode)
+
+    events = list(altdump.ProtocolEventReader(io.BytesIO(contents), reader=model_reader))
+    stages['json'] = measure(events, lambda event: len(simplejson.dumps(event.to_dict(), ignore_nan=True)))
+
+    reader = altdump.ProtocolEventReader(io.BytesIO(contents), reader=model_reader)
+    stages['events'] = measure(range(len(events)), lambda _: next(reader) and 0)
+    return stages
+
+def compare(results, baseline, threshold):
+    regressions = 0
+    print(f'{"stage":<10} {"items/s":>12} {"baseline":>12} {"change":>8} {"p99 us":>10} {"baseline":>10}')
+    for stage, current in results['stages'].items():
+        previous = baseline['stages'].get(stage)
+        if not previous:
+            continue
+        change = current['items_per_s'] / previous['items_per_s'] - 1 if previous['items_per_s'] else 0
+        mark = ''
+        if change < -threshold:
+            regressions += 1
+            mark = ' REGRESSION'
+        print(f'{stage:<10} {current["items_per_s"]:>12.0f} {previous["items_per_s"]:>12.0f} {change * 100:>+7.1f}% '
+            f'{current["p99_us"]:>10.1f} {previous["p99_us"]:>10.1f}{mark}')
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the dump decoding stages on a synthetic dump.')
+    parser.add_argument('-p', '--packets', type=int, default=20000, help='number of space packets')
+    parser.add_argument('-c', '--connections', type=int, default=4, help='number of connections')
+    parser.add_argument('-m', '--mix', default=DEFAULT_MIX, help='relative weights of objects and tankstate packets')
+    parser.add_argument('-z', '--compressed', type=float, default=0.2, help='share of compressed packets for the unwrap stage')
+    parser.add_argument('-s', '--seed', type=int, default=0, help='random seed')
+    parser.add_argument('-d', '--dump', help='keep the synthetic dump in this file')
+    parser.add_argument('-o', '--output', help='write results as json')
+    parser.add_argument('-b', '--baseline', help='compare with results of a previous run')
+    parser.add_argument('-t', '--threshold', type=float, default=0.1, help='throughput drop reported as a regression')
+    parser.add_argument('--specialize', type=int, nargs='?', const=3, metavar='TOP', help='compare generic codecs with the TOP models specialized')
+    args = parser.parse_args()
+
+    if args.specialize is not None:
+        results = specialization(args.packets, args.specialize, args.seed)
+        print(f'{"codecs":<20} {"packets/s":>12} {"MB/s":>8} {"p50 us":>8} {"p99 us":>8} {"speedup":>8}')
+        for name, result in results.items():
+            generic = results[name.replace('specialized', 'generic')]
+            print(f'{name:<20} {result["items_per_s"]:>12.0f} {result["mb_per_s"]:>8.2f} {result["p50_us"]:>8.1f} '
+                f'{result["p99_us"]:>8.1f} {result["items_per_s"] / generic["items_per_s"]:>7.2f}x')
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        fname = args.dump or os.path.join(tmp, 'bench.tnk')
+        generate_dump(fname, args.packets, args.connections, args.mix, args.seed)
+        stages = run(fname, args.compressed, args.seed)
+
+    results = {
+        'meta': {
+            'date': datetime.datetime.utcnow().isoformat(),
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'machine': platform.machine(),
+            'packets': args.packets,
+            'connections': args.connections,
+            'mix': args.mix,
+            'compressed': args.compressed,
+            'seed': args.seed
+        },
+        'stages': stages
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            simplejson.dump(results, f, indent=4)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = simplejson.load(f)
+        sys.exit(1 if compare(results, baseline, args.threshold) else 0)
+
+    print(f'{"stage":<10} {"items":>8} {"items/s":>12} {"MB/s":>8} {"p50 us":>8} {"p99 us":>8} {"max us":>9}')
+    for stage, result in stages.items():
+        print(f'{stage:<10} {result["items"]:>8} {result["items_per_s"]:>12.0f} {result["mb_per_s"]:>8.2f} '
+            f'{result["p50_us"]:>8.1f} {result["p99_us"]:>8.1f} {result["max_us"]:>9.1f}')
+
+if __name__ == '__main__':
+    main()
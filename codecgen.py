@@ -2,6 +2,7 @@
 import collections
 import datetime
 import argparse
+import struct
 import json
 import glob
 import os
@@ -91,7 +92,8 @@ class ClassWriter():
         return self
 
     def line(self, line):
-        self.buf.write(' ' * (self.level * self.indent))
+        if line:
+            self.buf.write(' ' * (self.level * self.indent))
         self.buf.write(line + '\n')
         return self
 
@@ -332,13 +334,75 @@ class CodecDefinitionWriter():
         'IGameObject': 'packet.readLong()',
         'Date': 'packet.readLong()'
     }
-    def __init__(self, codecs):
+    FORMATS = {
+        'Byte': 'B',
+        'Short': 'h',
+        'int': 'i',
+        'Long': 'q',
+        'Float': 'f',
+        'Number': 'd',
+        'Boolean': '?',
+        'IGameObject': 'q',
+        'Date': 'q'
+    }
+    WRITERS = {
+        'Byte': 'packet.writeByte({})',
+        'Short': 'packet.writeShort({})',
+        'int': 'packet.writeInt({})',
+        'Long': 'packet.writeLong({})',
+        'Float': 'packet.writeFloat({})',
+        'Number': 'packet.writeDouble({})',
+        'Boolean': 'packet.writeByte({})',
+        'String': 'packet.writeString({})',
+        'IGameObject': 'packet.writeLong({})',
+        'Date': 'packet.writeLong({})'
+    }
+    RANDOM = {
+        'Byte': 'rng.randrange(0x100)',
+        'Short': 'rng.randrange(-0x8000, 0x8000)',
+        'int': 'rng.randrange(-0x80000000, 0x80000000)',
+        'Long': 'rng.randrange(-1 << 63, 1 << 63)',
+        'Float': 'util.random_float(rng)',
+        'Number': 'rng.uniform(-1e9, 1e9)',
+        'Boolean': 'rng.random() < 0.5',
+        'String': 'util.random_string(rng)',
+        'IGameObject': 'rng.randrange(-1 << 63, 1 << 63)',
+        'Date': 'rng.randrange(1 << 41)'
+    }
+    def __init__(self, codecs, compact=False, hot=()):
         self.codecs = codecs
+        self.compact = compact
+        # codecs of the most frequent models get a read() with nested codecs inlined
+        self.hot = set(hot)
 
-    def emit_type_call(self, type_info, dependencies):
+    def all_fields(self, codec):
+        if codec.inherits != 'Codec':
+            return self.all_fields(self.codecs[codec.inherits])
+        return codec.fields
+
+    def emit_inline(self, codec, dependencies, inline):
+        fields = self.all_fields(codec)
+        inline = inline + (codec.name,)
+        calls = [self.emit_type_call(type_info, dependencies, inline) for type_info in fields.values()]
+        if None in calls:
+            return None
+        if self.compact:
+            return f'{codec.name}.Record({", ".join(calls)})'
+        items = [f"'codec': '{codec.name}'"] + [f"'{field}': {call}" for field, call in zip(fields, calls)]
+        return '{' + ', '.join(items) + '}'
+
+    def emit_type_call(self, type_info, dependencies, inline=None):
         call = None
         if type_info.info_type == 'CollectionCodecInfo':
-            call = self.emit_type_call(type_info.element_type, dependencies)
+            element = type_info.element_type
+            fmt = self.element_format(element)
+            if fmt and not element.optional:
+                # primitive vectors are unpacked in one call
+                call = f"packet.readVector('{fmt}')"
+                if type_info.optional:
+                    call = f'None if optional.next() else {call}'
+                return call
+            call = self.emit_type_call(element, dependencies, inline)
         else:
             field_type = type_info.type_name
             if type_info.info_type == 'EnumCodecInfo':
@@ -348,7 +412,11 @@ class CodecDefinitionWriter():
                 call = self.PRIMITIVES[field_type]
             elif field_type in self.codecs:
                 field_codec = self.codecs[field_type]
-                call = f'{field_codec.name}().read(packet, optional)'
+                # recursive codecs stop being inlined at the first repetition
+                if inline is not None and field_codec.name not in inline:
+                    call = self.emit_inline(field_codec, dependencies, inline)
+                if not call:
+                    call = f'{field_codec.name}().read(packet, optional)'
                 if field_codec not in dependencies:
                     dependencies.append(field_codec)
             elif field_type.endswith('Resource'):
@@ -365,24 +433,224 @@ class CodecDefinitionWriter():
 
         return call
 
+    def element_format(self, type_info):
+        if type_info.info_type == 'CollectionCodecInfo':
+            return None
+        field_type = type_info.type_name
+        if type_info.info_type == 'EnumCodecInfo':
+            field_type = 'int'
+        if field_type in self.FORMATS:
+            return self.FORMATS[field_type]
+        if field_type not in self.codecs and field_type.endswith('Resource'):
+            return 'q'
+        return None
+
+    def fixed_size(self, type_info):
+        fmt = self.element_format(type_info)
+        return struct.calcsize('>' + fmt) if fmt else None
+
+    def emit_skip(self, type_info, dependencies):
+        size = self.fixed_size(type_info)
+        if size:
+            lines = [f'packet.skip({size})']
+        elif type_info.info_type == 'CollectionCodecInfo':
+            element = type_info.element_type
+            size = self.fixed_size(element)
+            if size and not element.optional:
+                lines = [f'packet.skip({size} * protocol.decode_length(packet))']
+            elif size:
+                lines = [f'packet.skip({size} * sum(not optional.next() for _ in range(protocol.decode_length(packet))))']
+            else:
+                inner = self.emit_skip(element, dependencies)
+                if not inner:
+                    return None
+                lines = ['for _ in range(protocol.decode_length(packet)):'] + ['    ' + line for line in inner]
+        elif type_info.type_name == 'String':
+            lines = ['packet.skipString()']
+        elif type_info.type_name in self.codecs:
+            field_codec = self.codecs[type_info.type_name]
+            lines = [f'{field_codec.name}().skip(packet, optional)']
+            if field_codec not in dependencies:
+                dependencies.append(field_codec)
+        else:
+            return None
+
+        if type_info.optional:
+            lines = ['if not optional.next():'] + ['    ' + line for line in lines]
+        return lines
+
+    def write_skip(self, codec, writer, dependencies):
+        writer.line('def skip(self, packet, optional):').up()
+        lines, pending = list(), 0
+        for type_info in codec.fields.values():
+            size = self.fixed_size(type_info)
+            # consecutive fixed width fields are skipped at once
+            if size and not type_info.optional:
+                pending += size
+                continue
+            field_lines = self.emit_skip(type_info, dependencies)
+            if not field_lines:
+                continue
+            if pending:
+                lines.append(f'packet.skip({pending})')
+                pending = 0
+            lines += field_lines
+        if pending:
+            lines.append(f'packet.skip({pending})')
+        for line in lines or ['pass']:
+            writer.line(line)
+        writer.down()
+
+    def emit_write(self, type_info, value, dependencies, depth=0):
+        if type_info.info_type == 'CollectionCodecInfo':
+            element = type_info.element_type
+            fmt = self.element_format(element)
+            if fmt and not element.optional:
+                lines = [f"packet.writeVector('{fmt}', {value})"]
+            else:
+                item = f'item{depth}'
+                inner = self.emit_write(element, item, dependencies, depth + 1)
+                if not inner:
+                    return None
+                lines = [f'packet.writeBytes(protocol.encode_length(len({value})))', f'for {item} in {value}:']
+                lines += ['    ' + line for line in inner]
+        else:
+            field_type = type_info.type_name
+            if type_info.info_type == 'EnumCodecInfo':
+                field_type = 'int'
+
+            if field_type in self.WRITERS:
+                lines = [self.WRITERS[field_type].format(value)]
+            elif field_type in self.codecs:
+                field_codec = self.codecs[field_type]
+                lines = [f'{field_codec.name}().write(packet, optional, {value})']
+                if field_codec not in dependencies:
+                    dependencies.append(field_codec)
+            elif field_type.endswith('Resource'):
+                lines = [f'packet.writeLong({value})']
+            else:
+                return None
+
+        if type_info.optional:
+            lines = [f'optional.append({value} is None)', f'if {value} is not None:'] + ['    ' + line for line in lines]
+        return lines
+
+    def emit_random(self, type_info, dependencies):
+        if type_info.info_type == 'CollectionCodecInfo':
+            call = self.emit_random(type_info.element_type, dependencies)
+            if call == 'None':
+                return call
+            call = f'[{call} for _ in range(rng.randrange(4))]'
+        else:
+            field_type = type_info.type_name
+            if type_info.info_type == 'EnumCodecInfo':
+                call = 'rng.randrange(4)'
+            elif field_type in self.RANDOM:
+                call = self.RANDOM[field_type]
+            elif field_type in self.codecs:
+                field_codec = self.codecs[field_type]
+                call = f'{field_codec.name}().random(rng)'
+                if field_codec not in dependencies:
+                    dependencies.append(field_codec)
+            elif field_type.endswith('Resource'):
+                call = 'rng.randrange(1 << 40)'
+            else:
+                return 'None'
+
+        if type_info.optional:
+            call = f'None if rng.random() < 0.25 else {call}'
+        return call
+
+    def write_writer(self, fields, writer, dependencies):
+        writer.line('def write(self, packet, optional, data):').up()
+        lines = list()
+        for i, (field, type_info) in enumerate(fields.items()):
+            value = f'data[{i}]' if self.compact else f"data['{field}']"
+            lines += self.emit_write(type_info, value, dependencies) or list()
+        for line in lines or ['pass']:
+            writer.line(line)
+        writer.down()
+
     def write(self, codec):
         dependencies = list()
         if codec.inherits != 'Codec':
             dependencies.append(self.codecs[codec.inherits])
         writer = ClassWriter()
         writer.line(f'class {codec.name}({codec.inherits}):').up()
-        if not codec.fields:
+        if self.compact:
+            return self.write_compact(codec, writer, dependencies)
+        hot = codec.name in self.hot and self.all_fields(codec)
+        if hot:
+            self.write_specialized(codec, writer, dependencies)
+            if codec.inherits != 'Codec':
+                return writer.buf.getvalue(), dependencies
+        elif not codec.fields:
             writer.line('pass')
             return writer.buf.getvalue(), dependencies
-        writer.line('def read(self, packet, optional):').up()
-        writer.line('data = super().read(packet, optional)')
+        else:
+            writer.line('def read(self, packet, optional):').up()
+            writer.line('data = super().read(packet, optional)')
+            for field, type_info in codec.fields.items():
+                call = self.emit_type_call(type_info, dependencies)
+                if not call:
+                    print('Cannot decode:', type_info)
+                writer.line(f"data['{field}'] = {call}")
+            writer.line('return data').down()
+        writer.line('')
+        self.write_skip(codec, writer, dependencies)
+        writer.line('')
+        self.write_writer(codec.fields, writer, dependencies)
+        writer.line('')
+        writer.line('def random(self, rng):').up()
+        writer.line('data = super().random(rng)')
         for field, type_info in codec.fields.items():
-            call = self.emit_type_call(type_info, dependencies)
+            writer.line(f"data['{field}'] = {self.emit_random(type_info, dependencies)}")
+        writer.line('return data').down()
+        return writer.buf.getvalue(), dependencies
+
+    def write_specialized(self, codec, writer, dependencies):
+        # one dict display instead of super().read() and an assignment per field
+        writer.line('def read(self, packet, optional):').up()
+        writer.line('return {').up()
+        writer.line("'codec': type(self).__name__,")
+        for field, type_info in self.all_fields(codec).items():
+            call = self.emit_type_call(type_info, dependencies, (codec.name,))
             if not call:
                 print('Cannot decode:', type_info)
-            writer.line(f"data['{field}'] = {call}")
+            writer.line(f"'{field}': {call},")
+        writer.down().line('}').down()
+
+    def write_compact(self, codec, writer, dependencies):
+        fields = self.all_fields(codec)
+        hot = codec.name in self.hot and fields
+        names = ', '.join(f"'{field}'" for field in fields)
+        if len(fields) == 1:
+            names += ','
+        writer.line(f"Record = record_type('{codec.name}', ({names}))")
+        if codec.inherits != 'Codec' and not hot:
+            return writer.buf.getvalue(), dependencies
 
-        writer.line('return data')
+        writer.line('')
+        writer.line('def read(self, packet, optional):').up()
+        writer.line('return self.Record(').up()
+        for type_info in fields.values():
+            call = self.emit_type_call(type_info, dependencies, (codec.name,) if hot else None)
+            if not call:
+                print('Cannot decode:', type_info)
+            writer.line(f'{call},')
+        writer.down().line(')').down()
+        if codec.inherits != 'Codec':
+            return writer.buf.getvalue(), dependencies
+        writer.line('')
+        self.write_skip(codec, writer, dependencies)
+        writer.line('')
+        self.write_writer(fields, writer, dependencies)
+        writer.line('')
+        writer.line('def random(self, rng):').up()
+        writer.line('return self.Record(').up()
+        for type_info in fields.values():
+            writer.line(f'{self.emit_random(type_info, dependencies)},')
+        writer.down().line(')').down()
         return writer.buf.getvalue(), dependencies
 
 def classes_by_keyword(path, keyword, sort=False):
@@ -396,7 +664,7 @@ def classes_by_keyword(path, keyword, sort=False):
         classes.sort(key=lambda x: x.class_name)
     return classes
 
-def generate(path, filename, comments=None):
+def read_definitions(path):
     codecs = dict()
     for code in classes_by_keyword(path, 'implements ICodec'):
         reader = CodecReader(code.string)
@@ -424,14 +692,26 @@ def generate(path, filename, comments=None):
             model.update_references(codecs)
             models.append(model)
         models += server_models[reader.server_model]
+    return codecs, models
+
+def load_profile(fname, top):
+    # written by altdump.py --profile-json, models are ranked by total decode time
+    with open(fname, 'r') as f:
+        profile = json.load(f)
+    ranked = sorted(profile['models'].items(), key=lambda x: x[1]['total'], reverse=True)
+    return {int(model_id) for model_id, _ in ranked[:top]}
 
+def render(codecs, models, comments=None, compact=False, hot_models=()):
     writer = ClassWriter()
     writer.line('CODECS = {').up()
     to_write = collections.deque()
+    hot = set()
     for model in models:
         codec = model.get_codec(codecs)
         writer.line(f'{model.model_id}: {codec.name}(),')
         to_write.appendleft(codec)
+        if model.model_id in hot_models:
+            hot.add(codec.name)
     writer.down().line('}')
 
     now = datetime.datetime.utcnow().strftime('%a, %d %b %Y %H:%M:%S GMT')
@@ -441,12 +721,15 @@ def generate(path, filename, comments=None):
         for line in comments:
             prelude.line(f'# {line}')
 
-    prelude.line('from alternativa.model import Codec')
-    prelude.line('from alternativa import protocol')
+    if compact:
+        prelude.line('from alternativa.model import Codec, record_type')
+    else:
+        prelude.line('from alternativa.model import Codec')
+    prelude.line('from alternativa import protocol, util')
     sections = [prelude.buf.getvalue()]
 
     written = set()
-    codec_writer = CodecDefinitionWriter(codecs)
+    codec_writer = CodecDefinitionWriter(codecs, compact=compact, hot=hot)
     while to_write:
         codec = to_write.pop()
         if codec in written:
@@ -461,18 +744,27 @@ def generate(path, filename, comments=None):
         to_write += dependencies
 
     sections.append(writer.buf.getvalue())
+    return '\n'.join(sections), len(written), len(hot)
+
+def generate(path, filename, comments=None, compact=False, hot_models=()):
+    codecs, models = read_definitions(path)
+    source, count, specialized = render(codecs, models, comments, compact, hot_models)
     with open(filename, 'w') as f:
-        f.write('\n'.join(sections))
+        f.write(source)
 
-    print(f'Generated {len(written)} codecs')
+    print(f'Generated {count} codecs, {specialized} specialized')
 
 def main():
     parser = argparse.ArgumentParser(description='Generate Python codecs from Tanki Online sources.')
     parser.add_argument('path', help='path to scan for sources')
     parser.add_argument('filename', nargs='?', default='alternativa/codecs.py', help='generated codecs file')
+    parser.add_argument('-c', '--compact', action='store_true', help='decode into tuple records instead of dicts')
+    parser.add_argument('-p', '--profile', help='decode profile from altdump.py --profile-json, used to specialize the slowest models')
+    parser.add_argument('-t', '--top', type=int, default=10, help='number of models to specialize')
     args = parser.parse_args()
 
-    generate(args.path, args.filename)
+    hot_models = load_profile(args.profile, args.top) if args.profile else ()
+    generate(args.path, args.filename, compact=args.compact, hot_models=hot_models)
 
 if __name__ == '__main__':
     main()
@@ -1,6 +1,10 @@
 #!/usr/bin/env python3
+import concurrent.futures
 import urllib.request
 import email.utils
+import argparse
+import hashlib
+import shlex
 import subprocess
 import shutil
 import tarfile
@@ -18,6 +22,10 @@ PIDFILE = '.pid'
 BASE_URL = 'https://s.eu.tankionline.com/libs/'
 MANIFEST = 'manifest.json'
 WORKDIR = 'archive'
+SCRIPT_CACHE = os.path.join(WORKDIR, 'scripts')
+DECOMPILER = 'java -Xms{heap}M -Xmx{heap}M -jar bin/ffdec/ffdec.jar'
+HEAP_PER_JOB = 384
+MEMORY_BUDGET = 1536
 FFDEC = 'parallelSpeedUp=0,exportTimeout=86400,decompilationTimeoutFile=3600,decompilationTimeoutSingleMethod=600'
 ORIGIN = 'git@github.com:XXLuigiMario/TankiOnlineCodecs.git'
 ENV = {
@@ -55,14 +63,67 @@ def archive():
     shutil.move(latest, manifest_file)
     return tarball
 
-def generate_from_tar(tarball):
+def hash_file(fname):
+    h = hashlib.sha256()
+    with open(fname, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+class Decompiler():
+    def __init__(self, command=DECOMPILER, budget=MEMORY_BUDGET, heap=HEAP_PER_JOB, cache=SCRIPT_CACHE):
+        self.command = command
+        self.heap = min(heap, budget)
+        # each decompiler reserves its whole heap, so the budget bounds concurrency
+        self.workers = max(1, budget // self.heap)
+        self.cache = cache
+
+    def args(self, *args):
+        return shlex.split(self.command.format(heap=self.heap)) + list(args)
+
+    def version(self):
+        p = subprocess.Popen(self.args('-help'), stdout=subprocess.PIPE, text=True)
+        version = p.stdout.readline().rstrip()
+        p.kill()
+        p.wait()
+        return version
+
+    def _export(self, swf_file, digest):
+        cached = os.path.join(self.cache, digest)
+        if os.path.isdir(cached):
+            return cached, True
+
+        tmp = f'{cached}.{os.getpid()}.tmp'
+        shutil.rmtree(tmp, ignore_errors=True)
+        subprocess.check_call(self.args('-config', FFDEC, '-export', 'script', tmp, swf_file))
+        os.replace(tmp, cached)
+        return cached, False
+
+    def export_all(self, swf_files):
+        os.makedirs(self.cache, exist_ok=True)
+        # identical SWFs within one tarball only need to be decompiled once
+        by_digest = dict()
+        for swf_file in swf_files:
+            by_digest.setdefault(hash_file(swf_file), list()).append(swf_file)
+
+        exported = dict()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = {pool.submit(self._export, files[0], digest): digest for digest, files in by_digest.items()}
+            for future in concurrent.futures.as_completed(futures):
+                digest = futures[future]
+                scripts, cached = future.result()
+                for swf_file in by_digest[digest]:
+                    exported[swf_file] = scripts
+                    state = 'cached' if cached else 'decompiled'
+                    logging.info(f'{os.path.basename(swf_file)} ({digest[:12]}): {state}')
+        return exported
+
+def generate_from_tar(tarball, decompiler):
     codecs_repo = os.path.join(WORKDIR, 'codecs')
     subprocess.check_call(['git', 'init', codecs_repo])
     subprocess.call(['git', 'remote', 'add', 'origin', ORIGIN], cwd=codecs_repo)
 
-    p = subprocess.Popen(['java', '-jar', 'bin/ffdec/ffdec.jar', '-help'], stdout=subprocess.PIPE, text=True)
-    decompiler = p.stdout.readline().rstrip()
-    p.kill()
+    version = decompiler.version()
 
     to_scan = list()
     with tempfile.TemporaryDirectory() as tmp:
@@ -73,12 +134,12 @@ def generate_from_tar(tarball):
                     tar.extract(member, path=tmp)
                     to_scan.append(name)
 
-        for swf in to_scan:
-            swf_file = os.path.join(tmp, swf)
-            scripts, _ = os.path.splitext(swf_file)
-            subprocess.check_call(['java', '-Xms384M', '-Xmx384M', '-jar', 'bin/ffdec/ffdec.jar', '-config', FFDEC, '-export', 'script', scripts, swf_file])
+        swf_files = [os.path.join(tmp, swf) for swf in to_scan]
+        for swf_file, scripts in decompiler.export_all(swf_files).items():
+            target, _ = os.path.splitext(swf_file)
+            shutil.copytree(scripts, target)
 
-        comments = [f'Decompiler: {decompiler}'] + to_scan
+        comments = [f'Decompiler: {version}'] + to_scan
         codecgen.generate(tmp, os.path.join(codecs_repo, 'codecs.py'), comments=comments)
 
     subprocess.check_call(['git', 'add', 'codecs.py'], cwd=codecs_repo)
@@ -86,6 +147,13 @@ def generate_from_tar(tarball):
     subprocess.check_call(['git', 'push', '-u', 'origin', 'master'], cwd=codecs_repo)
 
 def main():
+    parser = argparse.ArgumentParser(description='Archive Tanki Online libraries and generate codecs for each version.')
+    parser.add_argument('--decompiler', default=DECOMPILER, help='decompiler command, {heap} is replaced by the heap size in MB')
+    parser.add_argument('--memory', type=int, default=MEMORY_BUDGET, help='total memory budget for concurrent decompilers in MB')
+    parser.add_argument('--heap', type=int, default=HEAP_PER_JOB, help='memory used by each decompiler in MB')
+    args = parser.parse_args()
+    decompiler = Decompiler(args.decompiler, budget=args.memory, heap=args.heap)
+
     logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
     logger = logging.getLogger()
     git_file = os.path.join(WORKDIR, 'git.json')
@@ -117,7 +185,7 @@ def main():
         if fname.endswith('.tar.gz') and fname not in git:
             tarball = os.path.join(WORKDIR, fname)
             logger.info(f'Generating codec definitions from {tarball}')
-            generate_from_tar(tarball)
+            generate_from_tar(tarball, decompiler)
             git.append(fname)            
             with open(git_file, 'w') as f:
                 json.dump(git, f)
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+import collections
+import datetime
+import argparse
+import heapq
+import struct
+import copy
+import os
+
+import altdump
+from alternativa import protocol, util
+
+MAX_OPEN = 64
+SPACE_OPENED = 3
+HOUR = 3600 * 1000
+
+def read_start(fname):
+    with open(fname, 'rb') as f:
+        return altdump.PacketReader(f).start
+
+def read_records(fname, source=0):
+    # yields the absolute time in milliseconds, the records are converted to the seconds PacketWriter expects
+    with open(fname, 'rb') as f:
+        for record in altdump.PacketReader(f):
+            when = record.time
+            record.time = when / 1000
+            yield when, source, record
+
+def opens_space(data):
+    packet = util.ByteArray(data)
+    optional = protocol.decode_null_map(packet)
+    decoder = protocol.ClientControlCommandDecoder()
+    try:
+        while packet.bytesAvailable():
+            if decoder.decode(packet, optional).command_id == SPACE_OPENED:
+                return True
+    except (IndexError, UnicodeDecodeError, struct.error):
+        pass
+    return False
+
+class ConnectionMap():
+    def __init__(self):
+        self.ids = dict()
+        self.used = set()
+        self.remapped = 0
+
+    def get(self, source, conn_id):
+        new_id = self.ids.get((source, conn_id))
+        if new_id is not None:
+            return new_id
+        if len(self.used) >= 65536:
+            raise ValueError('More than 65536 concurrent connections')
+        new_id = conn_id
+        while new_id in self.used:
+            new_id = (new_id + 1) % 65536
+        if new_id != conn_id:
+            self.remapped += 1
+        self.ids[(source, conn_id)] = new_id
+        self.used.add(new_id)
+        return new_id
+
+    def release(self, source, conn_id):
+        new_id = self.ids.pop((source, conn_id), None)
+        self.used.discard(new_id)
+
+def merge(fnames, output):
+    start = min(read_start(fname) for fname in fnames)
+    streams = [read_records(fname, source) for source, fname in enumerate(fnames)]
+    connections = ConnectionMap()
+    count = 0
+    with altdump.PacketWriter(output, start=start / 1000, autoflush=False) as w:
+        for _, source, record in heapq.merge(*streams):
+            conn_id = record.conn_id
+            if record.rec_type == altdump.RECORD_BEGIN:
+                # a connection id reused within one dump starts a new connection
+                connections.release(source, conn_id)
+            record.conn_id = connections.get(source, conn_id)
+            w.write(record)
+            if record.rec_type == altdump.RECORD_END:
+                connections.release(source, conn_id)
+            count += 1
+    return count, connections.remapped
+
+class WriterPool():
+    def __init__(self, max_open=MAX_OPEN):
+        self.max_open = max_open
+        self.writers = collections.OrderedDict()
+        self.created = set()
+
+    def write(self, fname, start, record):
+        writer = self.writers.get(fname)
+        if writer is None:
+            if len(self.writers) >= self.max_open:
+                _, oldest = self.writers.popitem(last=False)
+                oldest.close()
+            # files closed to stay under the limit are appended to when reopened
+            writer = altdump.PacketWriter(fname, start=start / 1000, autoflush=False, append=fname in self.created)
+            self.writers[fname] = writer.open()
+            self.created.add(fname)
+        else:
+            self.writers.move_to_end(fname)
+        writer.write(record)
+
+    def close(self, fname):
+        writer = self.writers.pop(fname, None)
+        if writer:
+            writer.close()
+
+    def close_all(self):
+        while self.writers:
+            _, writer = self.writers.popitem()
+            writer.close()
+
+def split_by_connection(fname, directory, max_open=MAX_OPEN):
+    stem = os.path.splitext(os.path.basename(fname))[0]
+    pool = WriterPool(max_open)
+    outputs, starts = dict(), dict()
+    pieces = 0
+    try:
+        for when, _, record in read_records(fname):
+            conn_id = record.conn_id
+            if record.rec_type == altdump.RECORD_BEGIN or conn_id not in outputs:
+                outputs[conn_id] = os.path.join(directory, f'{stem}.{pieces:05d}.conn{conn_id}.tnk')
+                starts[conn_id] = when
+                pieces += 1
+            pool.write(outputs[conn_id], starts[conn_id], record)
+            if record.rec_type == altdump.RECORD_END:
+                pool.close(outputs.pop(conn_id))
+    finally:
+        pool.close_all()
+    return sorted(pool.created)
+
+def split_by_hour(fname, directory, max_open=MAX_OPEN):
+    stem = os.path.splitext(os.path.basename(fname))[0]
+    pool = WriterPool(max_open)
+    # the begin record and handshake of each connection are repeated in every hour it spans,
+    # so that each piece can be decoded on its own
+    preambles, in_space, hours = dict(), dict(), dict()
+    try:
+        for when, _, record in read_records(fname):
+            conn_id = record.conn_id
+            hour = when - when % HOUR
+            output = os.path.join(directory, f'{stem}.{datetime.datetime.utcfromtimestamp(hour / 1000):%Y%m%d-%H}.tnk')
+            if record.rec_type == altdump.RECORD_BEGIN:
+                preambles[conn_id], in_space[conn_id] = list(), False
+            elif hours.get(conn_id, hour) != hour:
+                for previous in preambles.get(conn_id, ()):
+                    previous = copy.copy(previous)
+                    previous.time = record.time
+                    pool.write(output, hour, previous)
+            hours[conn_id] = hour
+            pool.write(output, hour, record)
+
+            if record.rec_type == altdump.RECORD_END:
+                preambles.pop(conn_id, None)
+                in_space.pop(conn_id, None)
+                hours.pop(conn_id, None)
+            elif conn_id in preambles and not in_space[conn_id]:
+                preambles[conn_id].append(record)
+                if record.rec_type == altdump.RECORD_DATA and record.outgoing:
+                    in_space[conn_id] = opens_space(record.data)
+    finally:
+        pool.close_all()
+    return sorted(pool.created)
+
+def main():
+    parser = argparse.ArgumentParser(description='Merge and split packet dumps without loading them into memory.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    merge_parser = subparsers.add_parser('merge', help='merge dumps into one ordered by record time')
+    merge_parser.add_argument('filenames', nargs='+', help='packet dump files')
+    merge_parser.add_argument('-o', '--output', required=True, help='merged packet dump file')
+    split_parser = subparsers.add_parser('split', help='split a dump by connection or by hour')
+    split_parser.add_argument('filename', help='packet dump file')
+    split_parser.add_argument('--by', choices=('conn', 'hour'), default='conn', help='how to split the dump')
+    split_parser.add_argument('-o', '--output', default='.', help='directory for the pieces')
+    split_parser.add_argument('--max-open', type=int, default=MAX_OPEN, help='maximum number of files open at once')
+    args = parser.parse_args()
+
+    if args.command == 'merge':
+        count, remapped = merge(args.filenames, args.output)
+        print(f'Merged {count} records from {len(args.filenames)} dumps into {args.output}, {remapped} connections renumbered')
+    else:
+        os.makedirs(args.output, exist_ok=True)
+        split = split_by_connection if args.by == 'conn' else split_by_hour
+        outputs = split(args.filename, args.output, args.max_open)
+        print(f'Split {args.filename} into {len(outputs)} files in {args.output}')
+
+if __name__ == '__main__':
+    main()
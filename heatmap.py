@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+import argparse
+import os
+
+import altdump
+from alternativa import spatial, registry
+
+def build(fname, cell=spatial.CELL_SIZE, dims=2, **options):
+    index = spatial.SpatialIndex(cell, dims)
+    with open(fname, 'rb') as f:
+        for _ in index.consume(altdump.ProtocolEventReader(f, **options)):
+            pass
+    return index
+
+def open_index(fname, cell=spatial.CELL_SIZE, dims=2, rebuild=False, **options):
+    # the grid is kept next to the dump and rebuilt when the dump is newer or was binned differently
+    grid_file = fname + spatial.GRID_SUFFIX
+    if not rebuild and os.path.isfile(grid_file) and os.path.getmtime(grid_file) >= os.path.getmtime(fname):
+        index = spatial.SpatialIndex.load(grid_file)
+        if index.cell == cell and index.dims == dims:
+            return index
+    index = build(fname, cell, dims, **options)
+    index.save(grid_file)
+    return index
+
+def parse_point(value):
+    return tuple(float(component) for component in value.split(','))
+
+def main():
+    parser = argparse.ArgumentParser(description='Heatmaps and proximity queries over tank positions in a packet dump.')
+    parser.add_argument('filename', help='packet dump file, the grid is saved next to it')
+    parser.add_argument('--cell', type=float, default=spatial.CELL_SIZE, help='grid cell size in world units')
+    parser.add_argument('--dims', type=int, choices=(2, 3), default=2, help='bin positions by x, y or by x, y, z')
+    parser.add_argument('--rebuild', action='store_true', help='decode the dump again even if a grid file exists')
+    parser.add_argument('--registry', metavar='DIR', help='pick codecs by protocol hash from a codec registry')
+    parser.add_argument('--space', type=int, help='only use this space (battle) id')
+    parser.add_argument('--near', type=parse_point, metavar='X,Y[,Z]', help='list objects within --radius of this point')
+    parser.add_argument('-r', '--radius', type=float, default=spatial.CELL_SIZE, help='radius for --near')
+    parser.add_argument('--since', help='only samples after this time (ISO 8601 UTC or unix seconds)')
+    parser.add_argument('--until', help='only samples before this time (ISO 8601 UTC or unix seconds)')
+    parser.add_argument('-n', '--top', type=int, default=20, help='number of heatmap cells to list per space')
+    args = parser.parse_args()
+    if not os.path.isfile(args.filename):
+        parser.error(f'{args.filename} not found')
+    if args.near and len(args.near) != args.dims:
+        parser.error(f'--near needs {args.dims} coordinates with --dims {args.dims}')
+
+    options = {'registry': registry.CodecRegistry(args.registry)} if args.registry else {}
+    index = open_index(args.filename, args.cell, args.dims, args.rebuild, **options)
+    if args.near:
+        since = altdump.parse_time(args.since) if args.since else None
+        until = altdump.parse_time(args.until) if args.until else None
+        found = index.near(args.near, args.radius, since, until, args.space)
+        for (space_id, object_id), (first, last) in sorted(found.items(), key=lambda x: x[1]):
+            print(f'space {space_id} object {object_id}: {first} - {last}')
+        print(f'{len(found)} objects within {args.radius} of {args.near}')
+        return
+
+    for space_id, grid in sorted(index.spaces.items()):
+        if args.space is not None and space_id != args.space:
+            continue
+        heatmap = index.heatmap(space_id)
+        print(f'space {space_id}: {len(grid)} samples in {len(heatmap)} cells')
+        for key, (count, speed) in sorted(heatmap.items(), key=lambda x: x[1][0], reverse=True)[:args.top]:
+            print(f'  {key}: {count} samples, mean speed {speed:.1f}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+import threading
+import argparse
+import asyncio
+import logging
+import queue
+import zlib
+
+import altdump
+from alternativa import protocol, util
+
+CHUNK_SIZE = 65536
+MAX_BUFFER = 1 << 24
+QUEUE_SIZE = 10000
+
+class FrameSplitter():
+    def __init__(self, max_buffer=MAX_BUFFER):
+        self.buffer = bytearray()
+        self.max_buffer = max_buffer
+
+    def feed(self, chunk):
+        self.buffer += chunk
+        packet = util.ByteArray(self.buffer)
+        payloads = list()
+        while True:
+            start = packet.position
+            payload = protocol.unwrap_packet(packet)
+            if payload is None:
+                break
+            payloads.append(bytes(payload.data))
+        del self.buffer[:start]
+        if len(self.buffer) > self.max_buffer:
+            raise ValueError(f'Incomplete packet exceeds {self.max_buffer} bytes')
+        return payloads
+
+class DumpWriter(threading.Thread):
+    def __init__(self, fname, size=QUEUE_SIZE):
+        super().__init__(name='DumpWriter', daemon=True)
+        self.queue = queue.Queue(size)
+        self.writer = altdump.PacketWriter(fname, autoflush=False)
+        self.records = 0
+        self.stalls = 0
+
+    def run(self):
+        with self.writer as w:
+            while True:
+                record = self.queue.get()
+                if record is None:
+                    break
+                w.write(record)
+                self.records += 1
+                if self.queue.empty():
+                    w.flush()
+
+    async def put(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # the disk fell behind, block this connection instead of buffering without bound
+            self.stalls += 1
+            await asyncio.get_running_loop().run_in_executor(None, self.queue.put, record)
+
+    def close(self):
+        self.queue.put(None)
+        self.join()
+
+class RecordingProxy():
+    def __init__(self, upstream, dump, chunk_size=CHUNK_SIZE):
+        self.upstream = upstream
+        self.dump = dump
+        self.chunk_size = chunk_size
+        self.next_id = 0
+
+    async def handle(self, client_reader, client_writer):
+        conn_id = self.next_id
+        self.next_id = (self.next_id + 1) % 65536
+        try:
+            upstream_reader, upstream_writer = await asyncio.open_connection(*self.upstream)
+        except OSError as e:
+            logging.warning('[%d] Upstream connection failed: %s', conn_id, e)
+            client_writer.close()
+            return
+
+        src = client_writer.get_extra_info('peername')[:2]
+        dst = upstream_writer.get_extra_info('peername')[:2]
+        logging.info('[%d] %s:%d -> %s:%d', conn_id, *src, *dst)
+        await self.dump.put(altdump.RecordBegin(conn_id, True, src, dst))
+        try:
+            sent, received = await asyncio.gather(
+                self.pump(conn_id, True, client_reader, upstream_writer),
+                self.pump(conn_id, False, upstream_reader, client_writer))
+        finally:
+            upstream_writer.close()
+            client_writer.close()
+        await self.dump.put(altdump.RecordEnd(conn_id, True))
+        logging.info('[%d] Closed, %d bytes sent, %d bytes received', conn_id, sent, received)
+
+    async def pump(self, conn_id, outgoing, reader, writer):
+        frames = FrameSplitter()
+        total = 0
+        try:
+            while True:
+                chunk = await reader.read(self.chunk_size)
+                if not chunk:
+                    break
+                writer.write(chunk)
+                total += len(chunk)
+                if frames is not None:
+                    try:
+                        payloads = frames.feed(chunk)
+                    except (ValueError, IndexError, zlib.error) as e:
+                        # keep relaying, only the recording of this direction stops
+                        logging.warning('[%d] Not recording %s traffic: %s', conn_id, 'outgoing' if outgoing else 'incoming', e)
+                        frames, payloads = None, ()
+                    for payload in payloads:
+                        await self.dump.put(altdump.RecordData(conn_id, outgoing, payload))
+                await writer.drain()
+            if writer.can_write_eof():
+                writer.write_eof()
+        except ConnectionError:
+            writer.close()
+        return total
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle, host, port)
+        for sock in server.sockets:
+            logging.info('Proxying %s:%d to %s:%d', *sock.getsockname()[:2], *self.upstream)
+        async with server:
+            await server.serve_forever()
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+    parser = argparse.ArgumentParser(description='Relay game connections to a server and record them as a packet dump.')
+    parser.add_argument('upstream', help='server address as host:port')
+    parser.add_argument('-o', '--output', required=True, help='packet dump file to write')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    parser.add_argument('-p', '--port', type=int, default=0, help='port to listen on, random by default')
+    parser.add_argument('-q', '--queue', type=int, default=QUEUE_SIZE, help='records buffered for the writer thread')
+    args = parser.parse_args()
+
+    host, port = args.upstream.rsplit(':', 1)
+    dump = DumpWriter(args.output, args.queue)
+    dump.start()
+    try:
+        asyncio.run(RecordingProxy((host, int(port)), dump).serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        dump.close()
+        logging.info('%d records written, writer queue was full %d times', dump.records, dump.stalls)
+
+if __name__ == '__main__':
+    main()
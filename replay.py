@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+import argparse
+import asyncio
+import logging
+import mmap
+import time
+import os
+
+import altdump
+from alternativa import protocol
+
+YIELD_EVERY = 256
+
+class MappedFile():
+    def __init__(self, buf):
+        self.buf = buf
+        self.position = 0
+
+    def read(self, length):
+        data = self.buf[self.position:self.position + length]
+        self.position += len(data)
+        return data
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.position
+        elif whence == os.SEEK_END:
+            offset += len(self.buf)
+        self.position = offset
+        return offset
+
+class ConnectionStats():
+    def __init__(self, peer):
+        self.peer = peer
+        self.start = time.monotonic()
+        self.records = 0
+        self.bytes = 0
+        self.lag = 0.0
+        self.max_lag = 0.0
+
+    def add(self, length, lag):
+        self.records += 1
+        self.bytes += length
+        self.lag += lag
+        if lag > self.max_lag:
+            self.max_lag = lag
+
+    def __str__(self):
+        elapsed = time.monotonic() - self.start
+        mean_lag = self.lag / self.records if self.records else 0
+        return (f'{self.peer}: {self.records} packets, {self.bytes} bytes in {elapsed:.2f}s '
+            f'({self.bytes / elapsed / 1024 if elapsed else 0:.1f} KB/s), '
+            f'lag mean {mean_lag * 1000:.1f} ms max {self.max_lag * 1000:.1f} ms')
+
+class ReplayServer():
+    def __init__(self, fname, speed=1.0, connections=None, outgoing=False, wrap=True):
+        self.speed = speed
+        self.connections = connections
+        self.outgoing = outgoing
+        self.wrap = wrap
+        self.clients = set()
+        with open(fname, 'rb') as f:
+            # every client reads from the same read-only mapping
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def records(self):
+        for record in altdump.PacketReader(MappedFile(self.map)):
+            if record.rec_type != altdump.RECORD_DATA or record.outgoing != self.outgoing:
+                continue
+            if self.connections is not None and record.conn_id not in self.connections:
+                continue
+            yield record
+
+    async def handle(self, reader, writer):
+        stats = ConnectionStats(writer.get_extra_info('peername'))
+        self.clients.add(stats)
+        loop = asyncio.get_running_loop()
+        start, first = loop.time(), None
+        try:
+            for i, record in enumerate(self.records()):
+                lag = 0.0
+                if self.speed:
+                    if first is None:
+                        first = record.time
+                    delay = start + (record.time - first) / 1000 / self.speed - loop.time()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    else:
+                        lag = -delay
+                elif i % YIELD_EVERY == 0:
+                    await asyncio.sleep(0)
+
+                data = protocol.wrap_packet(record.data) if self.wrap else record.data
+                writer.write(data)
+                await writer.drain()
+                stats.add(len(data), lag)
+        except ConnectionError:
+            pass
+        finally:
+            self.clients.discard(stats)
+            logging.info(str(stats))
+            writer.close()
+
+    async def report(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            for stats in list(self.clients):
+                logging.info(str(stats))
+
+    async def serve(self, host, port, interval=None):
+        server = await asyncio.start_server(self.handle, host, port)
+        for sock in server.sockets:
+            logging.info('Replaying on %s:%d', *sock.getsockname()[:2])
+        if interval:
+            asyncio.create_task(self.report(interval))
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        self.map.close()
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+    parser = argparse.ArgumentParser(description='Serve a packet dump to TCP clients with its original timing.')
+    parser.add_argument('filename', help='packet dump file')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    parser.add_argument('-p', '--port', type=int, default=0, help='port to listen on, random by default')
+    parser.add_argument('-s', '--speed', type=float, default=1.0, help='replay speed factor, 0 sends as fast as possible')
+    parser.add_argument('--conn', type=int, action='append', help='only replay this connection id')
+    parser.add_argument('--outgoing', action='store_true', help='replay client packets instead of server packets')
+    parser.add_argument('--raw', action='store_true', help='send payloads without packet length headers')
+    parser.add_argument('-i', '--interval', type=float, help='report per-client statistics every few seconds')
+    args = parser.parse_args()
+
+    connections = set(args.conn) if args.conn else None
+    server = ReplayServer(args.filename, args.speed, connections, args.outgoing, not args.raw)
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.interval))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+import argparse
+import random
+import struct
+import time
+import sys
+
+import altdump
+from alternativa import protocol, model, util
+
+def write_command(packet, optional, codec, object_id, model_id, data):
+    packet.writeBytes(struct.pack('>QQ', object_id, model_id))
+    codec.write(packet, optional, data)
+
+def random_packet(rng, codecs, count):
+    packet, optional, commands = util.ByteArray(), list(), list()
+    for _ in range(count):
+        model_id, codec = rng.choice(codecs)
+        object_id, data = rng.getrandbits(48), codec.random(rng)
+        write_command(packet, optional, codec, object_id, model_id, data)
+        commands.append((object_id, model_id, data))
+    return protocol.encode_null_map(optional) + bytes(packet.data), commands
+
+def generated_codecs(reader, models=None):
+    codecs = list()
+    for model_id, codec in reader.codecs.items():
+        if models and model_id not in models:
+            continue
+        if codec.generated:
+            codecs.append((model_id, codec))
+    return codecs
+
+def roundtrip(decoder, rng, model_id, codec, count):
+    stats = {'encoded': 0, 'failed': 0, 'bytes': 0, 'encode': 0.0, 'decode': 0.0}
+    clock = time.perf_counter
+    for _ in range(count):
+        start = clock()
+        payload, commands = random_packet(rng, [(model_id, codec)], 1)
+        encoded = clock()
+        try:
+            packet = util.ByteArray(payload)
+            optional = protocol.decode_null_map(packet)
+            command = decoder.decode(packet, optional)
+            ok = packet.bytesAvailable() == 0 and model.to_dict(command.data) == model.to_dict(commands[0][2])
+        except Exception:
+            ok = False
+        stats['encode'] += encoded - start
+        stats['decode'] += clock() - encoded
+        stats['encoded'] += 1
+        stats['bytes'] += len(payload)
+        stats['failed'] += not ok
+    return stats
+
+def write_dump(fname, rng, codecs, packets, commands):
+    with altdump.PacketWriter(fname) as w:
+        w.write(altdump.RecordBegin(0, True, ('127.0.0.1', 0), ('127.0.0.1', 0)))
+        space_opened = b'\x00\x03' + rng.randbytes(32) + struct.pack('>Q', rng.getrandbits(48))
+        w.write(altdump.RecordData(0, True, space_opened))
+        for _ in range(packets):
+            payload, _ = random_packet(rng, codecs, rng.randint(1, commands))
+            w.write(altdump.RecordData(0, rng.random() < 0.5, payload))
+        w.write(altdump.RecordEnd(0, True))
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate random space commands from the codec definitions.')
+    parser.add_argument('-m', '--model', type=lambda x: int(x, 0), action='append', help='only generate this model id')
+    parser.add_argument('-n', '--count', type=int, default=1000, help='round trips per model')
+    parser.add_argument('-s', '--seed', type=int, default=0, help='random seed')
+    parser.add_argument('-d', '--dump', help='write a dump with random packets instead of testing round trips')
+    parser.add_argument('-p', '--packets', type=int, default=10000, help='packets in the dump')
+    parser.add_argument('-c', '--commands', type=int, default=8, help='maximum commands per packet in the dump')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    decoder = protocol.SpaceCommandDecoder()
+    codecs = generated_codecs(decoder.reader, args.model)
+    if args.dump:
+        write_dump(args.dump, rng, codecs, args.packets, args.commands)
+        return
+
+    failures = 0
+    print(f'{"model_id":>20} {"codec":<40} {"failed":>7} {"bytes/cmd":>9} {"enc/s":>9} {"dec/s":>9}')
+    for model_id, codec in codecs:
+        stats = roundtrip(decoder, rng, model_id, codec, args.count)
+        failures += stats['failed']
+        encode = stats['encoded'] / stats['encode'] if stats['encode'] else 0
+        decode = stats['encoded'] / stats['decode'] if stats['decode'] else 0
+        print(f'{model_id:>20} {type(codec).__name__[:40]:<40} {stats["failed"]:>7} '
+            f'{stats["bytes"] / stats["encoded"]:>9.1f} {encode:>9.0f} {decode:>9.0f}')
+    sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()